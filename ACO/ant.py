@@ -1,3 +1,47 @@
 class Ant(object):
-    def __init__(self):
-        pass
\ No newline at end of file
+    # The path buffers of one serial ant walk, allocated once and reused by
+    # every ant of a colony. The loop erased path is path[:size], walked over
+    # the edges edges[:size - 1], and lengths[i] is the length of the path up
+    # to path[i]. index_of maps the positions the ant visited to their index
+    # in the path, entries are not removed when a loop is erased: one is only
+    # valid if the path still holds the position at that index, so erasing a
+    # loop only truncates size.
+    __slots__ = ("path", "edges", "lengths", "index_of", "size")
+
+    def __init__(self, max_steps):
+        self.path = [0] * (max_steps + 1)
+        self.edges = [0] * max_steps
+        self.lengths = [0.0] * (max_steps + 1)
+        self.index_of = {}
+        self.size = 0
+
+    def start(self, position):
+        self.path[0] = position
+        self.lengths[0] = 0.0
+        self.index_of.clear()
+        self.index_of[position] = 0
+        self.size = 1
+
+    def previous_position(self):
+        # the position before the current one, -1 at the start
+        return self.path[self.size - 2] if self.size > 1 else -1
+
+    def step(self, position, edge, length):
+        # walk to position over edge, erasing the loop if position is
+        # already on the path
+        index = self.index_of.get(position, self.size)
+        if index < self.size and self.path[index] == position:
+            self.size = index + 1
+            return
+        size = self.size
+        self.path[size] = position
+        self.edges[size - 1] = edge
+        self.lengths[size] = self.lengths[size - 1] + length
+        self.index_of[position] = size
+        self.size = size + 1
+
+    def path_edges(self):
+        return self.edges[:self.size - 1]
+
+    def path_length(self):
+        return self.lengths[self.size - 1]
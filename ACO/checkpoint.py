@@ -0,0 +1,122 @@
+import contextlib
+import json
+import os
+
+import numpy as np
+
+from colony import AntColony
+from graph import Graph
+
+
+# the AntColony arguments stored with every colony
+COLONY_OPTIONS = ["colony_size", "base_probability", "pheromone_per_ant", "pheromone_decay", "pheromone_color", "engine", "max_steps", "lazy_decay", "pheromone_strategy", "strategy_options", "candidate_count"]
+
+
+def save(landscape, path):
+    # Writes the state of landscape to the directory path: every array as its
+    # own .npy file, so restore can memory map them, and the rest of the state
+    # with the random generator states in state.json, written last. Files are
+    # written under a temporary name and replaced, so saving to the checkpoint
+    # a landscape was resumed from leaves the mapped old files intact.
+    os.makedirs(path, exist_ok=True)
+    colonies = landscape.colonies
+    edge_count = landscape.graph.edge_count
+
+    arrays = {
+        "coordinates": landscape.coordinates,
+        "food_positions": np.array(list(landscape.foods), dtype=np.int64),
+        "food_amounts": np.array(list(landscape.foods.values()), dtype=np.int64),
+        "pheromones": np.array([colony.pheromones for colony in colonies]).reshape(len(colonies), edge_count)
+    }
+    for name in Graph.__slots__[1:]:
+        arrays["graph_" + name] = getattr(landscape.graph, name)
+    for colony_index, colony in enumerate(colonies):
+        if colony.lazy_decay:
+            arrays["pheromone_stamps_{0}".format(colony_index)] = colony.pheromone_stamps
+        if colony.strategy.best_edges is not None:
+            arrays["best_edges_{0}".format(colony_index)] = colony.strategy.best_edges
+    for name, array in arrays.items():
+        with replacing(os.path.join(path, name + ".npy"), "wb") as array_file:
+            np.save(array_file, array)
+
+    state = {
+        "area": list(landscape.area),
+        "distance_mode": landscape.distance_mode,
+        "min_spacing": landscape.min_spacing,
+        "iteration": landscape.iteration,
+        "pheromone_tensor": landscape.pheromones is not None,
+        "rng": landscape.rng.bit_generator.state,
+        "colonies": [
+            {
+                "position": colony.position,
+                "food_count": colony.food_count,
+                "iteration": colony.iteration,
+                "best_length": colony.strategy.best_length,
+                "options": dict((name, getattr(colony, name)) for name in COLONY_OPTIONS),
+                "rng": colony.rng.bit_generator.state,
+                "random": colony.random.getstate()
+            }
+            for colony in colonies
+        ]
+    }
+    with replacing(os.path.join(path, "state.json"), "w") as state_file:
+        json.dump(state, state_file)
+
+
+@contextlib.contextmanager
+def replacing(path, mode):
+    # a file written under a temporary name that replaces path once it is
+    # complete
+    temporary = path + ".tmp"
+    with open(temporary, mode) as file:
+        yield file
+    os.replace(temporary, path)
+
+
+def restore(landscape, path, mmap_mode="r"):
+    # Loads a checkpoint written by save into a landscape under construction.
+    # The coordinates and the graph are memory mapped read only, pheromones
+    # copy on write, so only the pages that are used get read.
+    with open(os.path.join(path, "state.json")) as state_file:
+        state = json.load(state_file)
+
+    def load(name, mode=mmap_mode):
+        return np.load(os.path.join(path, name + ".npy"), mmap_mode=mode)
+
+    landscape.area = tuple(state["area"])
+    landscape.distance_mode = state["distance_mode"]
+    landscape.min_spacing = state["min_spacing"]
+    landscape.iteration = state["iteration"]
+    landscape.rng.bit_generator.state = state["rng"]
+
+    landscape.coordinates = load("coordinates")
+    landscape.graph = Graph.from_arrays(dict((name, load("graph_" + name)) for name in Graph.__slots__[1:]))
+    landscape.edges = landscape.graph.edge_list
+    landscape.foods = dict(zip(load("food_positions", None).tolist(), load("food_amounts", None).tolist()))
+
+    writable = "c" if mmap_mode else None
+    pheromones = load("pheromones", writable)
+    landscape.colonies = []
+    for colony_index, saved in enumerate(state["colonies"]):
+        options = dict(saved["options"])
+        options["pheromone_color"] = tuple(options["pheromone_color"])
+        colony = AntColony(landscape, saved["position"], **options)
+        colony.pheromones = pheromones[colony_index]
+        if colony.lazy_decay:
+            colony.pheromone_stamps = load("pheromone_stamps_{0}".format(colony_index), writable)
+        if saved["best_length"] != float("inf"):
+            colony.strategy.best_edges = load("best_edges_{0}".format(colony_index), None)
+            colony.strategy.best_length = saved["best_length"]
+            bounds = colony.strategy.bounds(colony)
+            colony.pheromone_floor = bounds[0] if bounds else 0
+        colony.food_count = saved["food_count"]
+        colony.iteration = saved["iteration"]
+        colony.rng.bit_generator.state = saved["rng"]
+        version, internal, gauss = saved["random"]
+        colony.random.setstate((version, tuple(internal), gauss))
+        landscape.colonies.append(colony)
+
+    if state["pheromone_tensor"]:
+        landscape.pheromones = pheromones
+        landscape.new_pheromones = np.zeros(pheromones.shape)
+        landscape.attach_pheromone_rows()
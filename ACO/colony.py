@@ -1,140 +1,394 @@
+import bisect
 import random
 
+import numpy as np
+
+import strategies
+import walker
+from ant import Ant
+from metrics import clock, count
+
+
+def decayed_levels(levels, stamps, iteration, decay, lower=0):
+    # pheromone levels stored at iteration stamps brought up to iteration.
+    # Every update clamps at 1 and decays, so after the first untouched update
+    # the level stays below 1 and only the decay is left. Bounded trails do
+    # not decay below lower.
+    age = iteration - stamps
+    levels = np.where(age > 0, np.minimum(levels, 1) * (1 - decay)**age, levels)
+    if lower:
+        np.maximum(levels, lower, out=levels)
+    return levels
+
+
+def update_levels(levels, deposits, decay, bounds=None):
+    # the pheromone update, in place: clamp at 1, decay and add the deposits
+    # clamped at 1, then clip to the (lower, upper) bounds if given. Works on
+    # the levels of one colony or on a colonies x edges array with one decay
+    # and bound per row.
+    np.minimum(levels, 1, out=levels)
+    levels *= 1 - decay
+    levels += np.minimum(deposits, 1)
+    if bounds is not None:
+        np.clip(levels, bounds[0], bounds[1], out=levels)
 
-class AntColony(object):
-    colony_positions = []
 
-    def __init__(self, landscape, position, colony_size=30, base_food=2000, base_probability=0.05, pheromone_per_ant=0.2, pheromone_decay=0.005, pheromone_color=(255,0,0)):
+class AntColony(object):
+    def __init__(self, landscape, position, colony_size=30, base_food=2000, base_probability=0.05, pheromone_per_ant=0.2, pheromone_decay=0.005, pheromone_color=(255,0,0), engine="serial", max_steps=200, lazy_decay=False, pheromone_strategy="ant_system", strategy_options=None, candidate_count=None, seed=None):
         self.position = position
-        AntColony.colony_positions.append(self.position)
+
+        # seed is a numpy Generator or anything np.random.default_rng takes.
+        # The serial engine draws its steps from a random.Random seeded from
+        # it, scalar draws from a Generator are too slow per step.
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(int(self.rng.integers(2**63)))
 
         self.colony_size = colony_size
         self.base_probability = base_probability
         self.pheromone_per_ant = pheromone_per_ant
         self.pheromone_decay = pheromone_decay
         self.pheromone_color = pheromone_color
+        # "serial" walks the ants one by one, "batch" walks all of them together
+        self.engine = engine
+        self.max_steps = max_steps
+        # with lazy_decay only the edges ants deposited on are updated, the
+        # decay of the other edges is applied when their level is read
+        self.lazy_decay = lazy_decay
+        # the name of the pheromone rule in strategies.STRATEGIES and the
+        # arguments of the rule
+        self.pheromone_strategy = pheromone_strategy
+        self.strategy_options = dict(strategy_options or {})
+        self.strategy = strategies.create_strategy(pheromone_strategy, self.strategy_options)
+        # with candidate_count ants choose among the candidate_count nearest
+        # neighbours of a point, see Graph.candidate_lists
+        self.candidate_count = candidate_count
 
         self.landscape = landscape
 
-        self.pheromone_matrix = {}
-        self.new_pheromone_matrix = {}
-
-        self.ants = []
+        self.pheromones = None
+        self.new_pheromones = None
+        self.pheromone_stamps = None
+        # the lower bound the levels were clipped to at the last update, read
+        # levels of lazy colonies never decay below it
+        self.pheromone_floor = 0
+        self.deposit_edges = []
+        self.deposit_amounts = []
+        self.iteration = 0
+        # the roulette segments of the points the serial walk visited in this
+        # population, and of their candidates, see path_segment
+        self.segments = {}
+        self.candidate_segments = {}
+        # the record of this colony in the landscape's Metrics, None when the
+        # simulation is not instrumented
+        self.metrics = None
+
+        # the path buffers of the serial walk, built on the first serial walk
+        self.ant = None
         self.food_count = base_food
         self.delta_food_count = 0
 
         self.initialize_pheromones()
-        self.generate_ants()
 
     def create_empty_pheromones(self):
-        pheromone_matrix = {}
-
-        for edge in self.landscape.edges:
-            pheromone_matrix[edge] = 0
-            pheromone_matrix[(edge[1], edge[0])] = 0
-
-        return pheromone_matrix
+        # one pheromone level per undirected edge, indexed by edge id
+        return np.zeros(self.landscape.graph.edge_count)
 
     def initialize_pheromones(self):
-        self.pheromone_matrix = self.create_empty_pheromones()
+        self.pheromones = self.create_empty_pheromones()
+        if self.lazy_decay:
+            # the iteration each stored level was last brought up to date
+            self.pheromone_stamps = np.zeros(len(self.pheromones), dtype=np.int64)
+        else:
+            self.new_pheromones = self.create_empty_pheromones()
 
     def clear_pheromones(self):
-        self.new_pheromone_matrix = self.create_empty_pheromones()
-
-    def generate_ants(self):
-        self.ants = []
-        for i in range(self.colony_size):
-            self.ants.append([])
+        if self.lazy_decay:
+            self.deposit_edges = []
+            self.deposit_amounts = []
+        else:
+            self.new_pheromones.fill(0)
+
+    def deposit_pheromones(self, edges, amounts):
+        # amounts is a single amount or one per edge, edges may repeat
+        if self.lazy_decay:
+            edges = np.asarray(edges, dtype=np.int64)
+            self.deposit_edges.append(edges)
+            self.deposit_amounts.append(np.broadcast_to(np.asarray(amounts, dtype=np.float64), edges.shape))
+        else:
+            np.add.at(self.new_pheromones, edges, amounts)
+
+    def pheromone_levels(self, edges=None):
+        # the current pheromone level of the given edges, of all edges when
+        # edges is None
+        if edges is None:
+            edges = slice(None)
+        if not self.lazy_decay:
+            return self.pheromones[edges]
+        return decayed_levels(self.pheromones[edges], self.pheromone_stamps[edges], self.iteration, self.pheromone_decay, self.pheromone_floor)
 
     def optimize(self):
         self.create_new_population()
 
     def create_new_population(self):
         old_food_count = self.food_count
-        self.generate_ants()
+        started = clock()
         self.clear_pheromones()
-        for ant in self.ants:
+        if self.engine == "batch":
+            self.walk_batch()
+        else:
+            self.walk_serial()
+        self.delta_food_count = old_food_count - self.food_count
+        if self.metrics is not None:
+            count(self.metrics, "population", clock() - started)
+            count(self.metrics, "food", self.food_count - old_food_count)
+
+    def walk_serial(self):
+        metrics = self.metrics
+        graph = self.landscape.graph
+        if self.ant is None:
+            self.ant = Ant(self.max_steps)
+        ant = self.ant
+        # pheromones only change between populations, the segments are
+        # built when a point is first visited and kept for the population
+        segments = self.segments = {}
+        candidate_segments = self.candidate_segments = {}
+        if self.candidate_count:
+            candidate_indptr, candidate_entries = self.landscape.candidate_lists(self.candidate_count)[:2]
+        # per step timers only run when instrumented
+        picking = erasing = 0.0
+        total_steps = capped = 0
+        # the paths of the ants that reached food, deposited together
+        path_edges = []
+        path_lengths = []
+        for i in range(self.colony_size):
             steps = 0
             current_position = self.position
-            ant.append(current_position)
+            ant.start(current_position)
             while current_position not in self.landscape.foods:
-                if steps >= 200:
+                if steps >= self.max_steps:
                     break
 
-                possible_paths = self.landscape.get_possible_paths(current_position)
-
-                next_position = self.pick_path(current_position, possible_paths)
-
-                if len(ant) > 1 and next_position == ant[-2]:  # don't walk back
+                if metrics is not None:
+                    started = clock()
+                segment = None
+                if self.candidate_count:
+                    # the candidates, unless the way back is the only one.
+                    # Points only have no candidates when they are isolated.
+                    segment = candidate_segments.get(current_position)
+                    if segment is None:
+                        segment = candidate_segments[current_position] = self.path_segment(
+                            candidate_entries[candidate_indptr[current_position]:candidate_indptr[current_position + 1]]
+                        )
+                    if not segment[1]:  # isolated point, no way to walk
+                        break
+                    if len(segment[1]) == 1 and segment[1][0] == ant.previous_position():
+                        segment = None
+                if segment is None:
+                    # all neighbours, built on the first fall back only
+                    segment = segments.get(current_position)
+                    if segment is None:
+                        segment = segments[current_position] = self.path_segment(slice(graph.indptr[current_position], graph.indptr[current_position + 1]))
+                    if not segment[1]:  # isolated point, no way to walk
+                        break
+
+                next_position, edge, length = self.pick_path(segment)
+                if metrics is not None:
+                    picking += clock() - started
+
+                # don't walk back, unless it is the only way out
+                if next_position == ant.previous_position() and len(segment[1]) > 1:
                     continue
-                if next_position in ant:
-                    subant = ant[:ant.index(next_position)]
-                    ant = subant
-                ant.append(next_position)
+                if metrics is not None:
+                    started = clock()
+                    ant.step(next_position, edge, length)
+                    erasing += clock() - started
+                else:
+                    ant.step(next_position, edge, length)
                 current_position = next_position
                 steps += 1
 
-            if steps >= 200:
+            total_steps += steps
+            if current_position not in self.landscape.foods:
+                capped += 1
+                continue
+
+            self.collect_food(current_position)
+            if ant.size > 1:
+                path_edges.append(ant.path_edges())
+                path_lengths.append(ant.path_length())
+
+        started = clock()
+        self.deposit_paths(
+            np.array([edge for ant_edges in path_edges for edge in ant_edges], dtype=np.int64),
+            np.array([len(ant_edges) for ant_edges in path_edges], dtype=np.int64),
+            np.array(path_lengths)
+        )
+        if metrics is not None:
+            count(metrics, "deposit", clock() - started)
+            count(metrics, "pick_path", picking)
+            count(metrics, "loop_erasure", erasing)
+            count(metrics, "steps", total_steps)
+            count(metrics, "capped", capped)
+
+    def walk_seed(self):
+        # the seed of the Generator of one batch walk, drawn from the colony
+        # stream so a walk in a worker process draws the same numbers
+        return int(self.rng.integers(2**63))
+
+    def entry_weights(self, entries):
+        # the selection weights of csr entries, lazy colonies only decay the
+        # levels of the segments their ants read
+        return self.base_probability + self.pheromone_levels(self.landscape.graph.edges[entries])
+
+    def walk_batch(self):
+        # the ants walk on the food of the landscape's food snapshot, which
+        # the worker pool uses as well
+        landscape = self.landscape
+        graph = landscape.graph
+        food_mask = np.zeros(graph.point_count, dtype=bool)
+        food_mask[landscape.food_positions()] = True
+
+        started = clock()
+        walk = walker.walk_ants(
+            graph.indptr,
+            graph.indices,
+            graph.reverse,
+            self.entry_weights if self.lazy_decay else self.base_probability + self.pheromones[graph.edges],
+            self.position,
+            food_mask,
+            self.colony_size,
+            self.max_steps,
+            np.random.default_rng(self.walk_seed()),
+            self.landscape.candidate_lists(self.candidate_count) if self.candidate_count else None
+        )
+        if self.metrics is not None:
+            # picking and loop erasure are one vectorized step in the walker
+            count(self.metrics, "walk", clock() - started)
+        self.deliver(*walker.arrivals(graph.edges, graph.edge_lengths, *walk))
+
+    def deliver(self, food_positions, path_lengths, edge_counts, path_edges, steps=0, capped=0):
+        # ants are handled in order, food emptied by an earlier ant is gone.
+        # steps and capped are the walk totals reported by walker.arrivals.
+        if self.metrics is not None:
+            count(self.metrics, "steps", steps)
+            count(self.metrics, "capped", capped)
+        successful = []
+        for ant, food_position in enumerate(food_positions.tolist()):
+            if food_position in self.landscape.foods:
+                self.collect_food(food_position)
+                successful.append(ant)
+
+        # ants that start on food have an empty path and leave no pheromones
+        successful = [ant for ant in successful if edge_counts[ant] > 0]
+        on_path = np.arange(path_edges.shape[1]) < edge_counts[successful][:, None]
+        started = clock()
+        self.deposit_paths(path_edges[successful][on_path], edge_counts[successful], path_lengths[successful])
+        if self.metrics is not None:
+            count(self.metrics, "deposit", clock() - started)
+
+    def collect_food(self, position):
+        self.landscape.foods[position] -= 1
+        self.food_count += 1
+
+        if self.landscape.foods[position] == 0:
+            started = clock()
+            del self.landscape.foods[position]
+
+            # food respawns from the landscape stream, in the same order
+            # whether the colonies walk in this process or in workers
+            occupied = [colony.position for colony in self.landscape.colonies]
+            new_food_position = int(self.landscape.rng.integers(0, len(self.landscape.coordinates)))
+            while new_food_position in occupied or new_food_position in self.landscape.foods:
+                new_food_position = int(self.landscape.rng.integers(0, len(self.landscape.coordinates)))
+            self.landscape.foods[new_food_position] = 2000
+            if self.metrics is not None:
+                count(self.metrics, "respawn", clock() - started)
+                count(self.metrics, "respawns")
+
+    def path_segment(self, entries):
+        # the roulette of a step over the given csr entries as lists: the
+        # cumulative selection weights and the points, edges and edge lengths
+        # of the entries. Only the levels of these edges are read.
+        # Segments have a handful of entries, so the weights are summed in
+        # python, the lazy decay is decayed_levels for one level.
+        graph = self.landscape.graph
+        edges = graph.edges[entries]
+        levels = self.pheromones[edges].tolist()
+        if self.lazy_decay:
+            keep = 1 - self.pheromone_decay
+            iteration = self.iteration
+            for index, stamp in enumerate(self.pheromone_stamps[edges].tolist()):
+                if stamp < iteration:
+                    level = levels[index]
+                    levels[index] = (level if level < 1 else 1.0) * keep**(iteration - stamp)
+            if self.pheromone_floor:
+                levels = [max(level, self.pheromone_floor) for level in levels]
+        cumulative = []
+        total = 0.0
+        for level in levels:
+            total += level + self.base_probability
+            cumulative.append(total)
+        return cumulative, graph.indices[entries].tolist(), edges.tolist(), graph.edge_lengths[edges].tolist()
+
+    def pick_path(self, segment):
+        # roulette over a segment of path_segment, the chosen entry is found
+        # by bisection in the cumulative weights
+        cumulative, points, edges, lengths = segment
+        entry = min(bisect.bisect_right(cumulative, self.random.random() * cumulative[-1]), len(points) - 1)
+        return points[entry], edges[entry], lengths[entry]
+
+    def dominant_path(self):
+        # follows the strongest pheromone edge from the colony, never back to
+        # a point already on the path, until it reaches food, gets stuck or
+        # takes max_steps steps. Returns the points and the length of the path.
+        graph = self.landscape.graph
+        path = [self.position]
+        visited = set(path)
+        length = 0.0
+        current = self.position
+        while current not in self.landscape.foods and len(path) <= self.max_steps:
+            entries = np.arange(graph.indptr[current], graph.indptr[current + 1])
+            open_entries = entries[[int(point) not in visited for point in graph.indices[entries]]]
+            if len(open_entries) == 0:
                 break
-
-            self.landscape.foods[current_position] -= 1
-            self.food_count += 1
-
-            if self.landscape.foods[current_position] == 0:
-                del self.landscape.foods[current_position]
-
-                new_food_position = random.randint(0, len(self.landscape.points)-1)
-                while new_food_position in AntColony.colony_positions or new_food_position in self.landscape.foods:
-                    new_food_position = random.randint(0, len(self.landscape.points)-1)
-                self.landscape.foods[new_food_position] = 2000
-
-            self.update_ant_pheromones(ant)
-        self.delta_food_count = old_food_count - self.food_count
-
-    def pick_path(self, current_position, possible_paths):
-        total_pheromones = 0
-        for next_position in possible_paths:
-            try:
-                total_pheromones += self.base_probability + self.pheromone_matrix[(current_position, next_position)]
-            except:
-                print("Pheromones: ",  self.pheromone_matrix)
-                raise
-        choice = random.random()
-        stop_at = choice * total_pheromones
-
-        pheromones = 0
-        for next_position in possible_paths:
-            if pheromones >= stop_at:
-                return next_position
-
-            pheromones += self.base_probability + self.pheromone_matrix[(current_position, next_position)]
-
-        return possible_paths[-1]
-
-    def update_ant_pheromones(self, ant):
-        total_path_length = self.path_length(ant)
-        for idx, pos in enumerate(ant[:-1]):
-            next_pos = ant[idx + 1]
-            try:
-                self.new_pheromone_matrix[(pos, next_pos)] += self.pheromone_per_ant/total_path_length
-                self.new_pheromone_matrix[(next_pos, pos)] += self.pheromone_per_ant/total_path_length
-            except KeyError as e:
-                print(e)
-                print(ant)
-                raise
-
-    def path_length(self, ant):
-        total_path_length = 0
-        for idx, pos in enumerate(ant[:-1]):
-            next_pos = ant[idx + 1]
-            total_path_length += self.landscape.distance_matrix[pos][next_pos]
-        return total_path_length
+            entry = open_entries[np.argmax(self.pheromone_levels(graph.edges[open_entries]))]
+            current = int(graph.indices[entry])
+            length += float(graph.edge_lengths[graph.edges[entry]])
+            path.append(current)
+            visited.add(current)
+        return path, length
+
+    def deposit_paths(self, edges, counts, lengths):
+        # the deposits of one iteration by the pheromone strategy: the edges
+        # of the loop erased paths one after the other, the number of edges
+        # and the length of every path
+        self.strategy.deposit(self, edges, counts, lengths)
 
     def update_pheromones(self):
-        for edge in self.pheromone_matrix:
-            old_pheromones = min(self.pheromone_matrix[edge], 1)
-            added_pheromones = min(self.new_pheromone_matrix[edge], 1)
-            new_pheromone_count = old_pheromones * (1-self.pheromone_decay) + added_pheromones
-
-            self.pheromone_matrix[edge] = new_pheromone_count
-            self.pheromone_matrix[(edge[1], edge[0])] = new_pheromone_count
\ No newline at end of file
+        started = clock()
+        bounds = self.strategy.bounds(self)
+        if self.lazy_decay:
+            touched = self.update_touched_pheromones(bounds)
+        else:
+            if self.metrics is not None:
+                touched = np.count_nonzero(self.new_pheromones)
+            update_levels(self.pheromones, self.new_pheromones, self.pheromone_decay, bounds)
+        self.pheromone_floor = bounds[0] if bounds else 0
+        self.iteration += 1
+        if self.metrics is not None:
+            count(self.metrics, "update_pheromones", clock() - started)
+            count(self.metrics, "edges_touched", int(touched))
+
+    def update_touched_pheromones(self, bounds=None):
+        # the same update as above for the edges with deposits only, they are
+        # stamped with the next iteration
+        # returns the number of edges updated
+        if not self.deposit_edges:
+            return 0
+        edges, inverse = np.unique(np.concatenate(self.deposit_edges), return_inverse=True)
+        added = np.bincount(inverse, weights=np.concatenate(self.deposit_amounts), minlength=len(edges))
+        levels = self.pheromone_levels(edges)
+        update_levels(levels, added, self.pheromone_decay, bounds)
+        self.pheromones[edges] = levels
+        self.pheromone_stamps[edges] = self.iteration + 1
+        return len(edges)
@@ -10,7 +10,60 @@ Robust checks disabled by default. May not work in degenerate set of points.
 """
 
 import numpy as np
-from math import sqrt
+
+
+def hilbertOrder(points, bits=16):
+    """Return the indices of points sorted along a Hilbert curve over their
+    bounding box.
+    ref: http://en.wikipedia.org/wiki/Hilbert_curve
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return np.zeros(0, dtype=int)
+    side = 2**bits
+    low = points.min(axis=0)
+    extent = max(np.ptp(points, axis=0).max(), 1e-12)
+    x, y = ((points - low) / extent * (side - 1)).astype(np.int64).T
+
+    # Convert (x, y) to the distance along the curve, one level at a time
+    d = np.zeros(len(points), dtype=np.int64)
+    s = side // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s //= 2
+    return np.argsort(d, kind="stable")
+
+
+def brioOrder(points, rng=np.random):
+    """Biased randomized insertion order: every point lands in a round with
+    probability 1/2 for the last round, 1/4 for the one before, etc. Rounds are
+    inserted from the smallest on and sorted along a Hilbert curve.
+    ref: Amenta, Choi, Rote. Incremental constructions con BRIO (2003)
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    rounds = max(int(np.log2(max(len(points), 1))), 1)
+    level = np.minimum(rng.geometric(0.5, size=len(points)), rounds)
+    order = []
+    for r in range(rounds, 0, -1):
+        members = np.flatnonzero(level == r)
+        order.extend(members[hilbertOrder(points[members])])
+    return order
+
+
+def grow(array, size):
+    """Return a copy of array with room for at least size rows.
+    """
+    grown = np.empty((max(size, 2 * len(array)),) + array.shape[1:],
+                     dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
 
 
 class Delaunay2D:
@@ -18,6 +71,11 @@ class Delaunay2D:
     Class to compute a Delaunay triangulation in 2D
     ref: http://en.wikipedia.org/wiki/Bowyer-Watson_algorithm
     ref: http://www.geom.uiuc.edu/~samuelp/del_project.html
+
+    Triangles live in slots of int32 arrays: triangles[t] holds the CCW
+    vertices of slot t and neighbours[t][i] the slot of the triangle opposite
+    to vertex i (-1 on the frame border). Slots of removed triangles are kept
+    in a free list and reused.
     """
 
     def __init__(self, center=(0, 0), radius=9999):
@@ -27,99 +85,202 @@ class Delaunay2D:
         """
         center = np.asarray(center)
         # Create coordinates for the corners of the frame
-        self.coords = [center+radius*np.array((-1, -1)),
-                       center+radius*np.array((+1, -1)),
-                       center+radius*np.array((+1, +1)),
-                       center+radius*np.array((-1, +1))]
-
-        # Create two dicts to store triangle neighbours and circumcircles.
-        self.triangles = {}
-        self.circles = {}
+        self.coords = np.empty((64, 2))
+        self.coords[:4] = [center+radius*np.array((-1, -1)),
+                           center+radius*np.array((+1, -1)),
+                           center+radius*np.array((+1, +1)),
+                           center+radius*np.array((-1, +1))]
+        self.coordCount = 4
+
+        # Arrays to store triangles, neighbours and circumcircles per slot
+        self.triangles = np.empty((128, 3), dtype=np.int32)
+        self.neighbours = np.empty((128, 3), dtype=np.int32)
+        self.centers = np.empty((128, 2))
+        self.radii = np.empty(128)
+        self.alive = np.zeros(128, dtype=bool)
+        self.slotCount = 0
+        self.freeSlots = []
 
         # Create two CCW triangles for the frame
-        T1 = (0, 1, 3)
-        T2 = (2, 3, 1)
-        self.triangles[T1] = [T2, None, None]
-        self.triangles[T2] = [T1, None, None]
+        T1, T2 = self.allocate(2)
+        self.triangles[T1] = (0, 1, 3)
+        self.triangles[T2] = (2, 3, 1)
+        self.neighbours[T1] = (T2, -1, -1)
+        self.neighbours[T2] = (T1, -1, -1)
 
         # Compute circumcenters and circumradius for each triangle
-        for t in self.triangles:
-            self.circles[t] = self.circumcenter(t)
+        self.storeCircles([T1, T2])
+
+        # Triangle where the point location walk starts
+        self.last_triangle = T2
+
+    def allocate(self, count):
+        """Return count free triangle slots, reusing removed ones first.
+        """
+        slots = [self.freeSlots.pop() for _ in range(min(count, len(self.freeSlots)))]
+        missing = count - len(slots)
+        if self.slotCount + missing > len(self.triangles):
+            size = self.slotCount + missing
+            self.triangles = grow(self.triangles, size)
+            self.neighbours = grow(self.neighbours, size)
+            self.centers = grow(self.centers, size)
+            self.radii = grow(self.radii, size)
+            alive = np.zeros(len(self.triangles), dtype=bool)
+            alive[:self.slotCount] = self.alive[:self.slotCount]
+            self.alive = alive
+        slots.extend(range(self.slotCount, self.slotCount + missing))
+        self.slotCount += missing
+        self.alive[slots] = True
+        return slots
 
     def circumcenter(self, tri):
         """Compute circumcenter and circumradius of a triangle in 2D.
-        Uses an extension of the method described here:
-        http://www.ics.uci.edu/~eppstein/junkyard/circumcenter.html
-        """
-        pts = np.asarray([self.coords[v] for v in tri])
-        pts2 = np.dot(pts, pts.T)
-        A = np.bmat([[2 * pts2, [[1],
-                                 [1],
-                                 [1]]],
-                      [[[1, 1, 1, 0]]]])
-
-        b = np.hstack((np.sum(pts * pts, axis=1), [1]))
-        try:
-            x = np.linalg.solve(A, b)
-        except Exception as e:
-            print(pts)
-            print(e)
-            print(A)
-            print(b)
-            print(pts2)
-        bary_coords = x[:-1]
-        center = np.dot(bary_coords, pts)
-
-        # radius = np.linalg.norm(pts[0] - center) # euclidean distance
-        radius = np.sum(np.square(pts[0] - center))  # squared distance
-        return (center, radius)
+        Closed form of the circumcenter relative to the first vertex:
+        http://en.wikipedia.org/wiki/Circumscribed_circle#Cartesian_coordinates_2
+        Raises ValueError for a degenerate (collinear) triangle.
+        """
+        centers, radii = self.circumcenters(np.asarray(tri).reshape(1, 3))
+        return (centers[0], radii[0])
+
+    def circumcenters(self, tris):
+        """Compute circumcenters and circumradius of several triangles, given
+        by their vertices, in one vectorized call. Returns an (N, 2) array of
+        centers and an (N,) array of squared radius.
+        Raises ValueError listing the degenerate (collinear) triangles.
+        """
+        tris = np.asarray(tris).reshape(-1, 3)
+        pts = self.coords[tris]
+        ax, ay = pts[:, 0, 0], pts[:, 0, 1]
+        bx, by = pts[:, 1, 0] - ax, pts[:, 1, 1] - ay
+        cx, cy = pts[:, 2, 0] - ax, pts[:, 2, 1] - ay
+        d = 2 * (bx * cy - by * cx)
+        degenerate = d == 0
+        if degenerate.any():
+            raise ValueError("Degenerate triangles, collinear vertices: {0}".format(
+                [(tuple(tris[i].tolist()), pts[i].tolist()) for i in np.flatnonzero(degenerate)]))
+
+        b2 = bx * bx + by * by
+        c2 = cx * cx + cy * cy
+        ux = (cy * b2 - by * c2) / d
+        uy = (bx * c2 - cx * b2) / d
+        centers = np.empty((len(tris), 2))
+        centers[:, 0] = ax + ux
+        centers[:, 1] = ay + uy
+        # radius = np.sqrt(ux * ux + uy * uy) # euclidean distance
+        return centers, ux * ux + uy * uy  # squared distance
+
+    def storeCircles(self, slots):
+        """Compute and store the circumcircles of the triangle slots in one batch.
+        """
+        self.centers[slots], self.radii[slots] = self.circumcenters(self.triangles[slots])
 
     def inCircleFast(self, tri, p):
         """Check if point p is inside of precomputed circumcircle of tri.
         """
-        center, radius = self.circles[tri]
-        return np.sum(np.square(center - p)) <= radius
+        dx = self.centers[tri, 0] - p[0]
+        dy = self.centers[tri, 1] - p[1]
+        return dx * dx + dy * dy <= self.radii[tri]
 
     def inCircleRobust(self, tri, p):
         """Check if point p is inside of circumcircle around the triangle tri.
         This is a robust predicate, slower than compare distance to centers
         ref: http://www.cs.cmu.edu/~quake/robust.html
         """
-        m1 = np.asarray([self.coords[v] - p for v in tri])
+        m1 = self.coords[self.triangles[tri]] - p
         m2 = np.sum(np.square(m1), axis=1).reshape((3, 1))
         m = np.hstack((m1, m2))    # The 3x3 matrix to check
         return np.linalg.det(m) <= 0
 
-    def addPoint(self, p):
-        """Add a point to the current DT, and refine it using Bowyer-Watson.
+    def locate(self, p):
+        """Find a triangle that contains point p.
+        Walks the triangle adjacency from the last inserted triangle, moving
+        over every edge that has p on its outer side. Falls back to a scan of
+        all triangles if the walk does not end.
         """
-        p = np.asarray(p)
-        idx = len(self.coords)
-        # print("coords[", idx,"] ->",p)
-        self.coords.append(p)
+        px, py = p
+        T = self.last_triangle
+        for _ in range(self.slotCount):
+            tri = self.triangles[T].tolist()
+            for i in range(3):
+                # Edge opposite of vertex i, CCW oriented
+                ax, ay = self.coords[tri[(i+1) % 3]]
+                bx, by = self.coords[tri[(i+2) % 3]]
+                if (bx - ax) * (py - ay) - (by - ay) * (px - ax) < 0:
+                    T = int(self.neighbours[T, i])
+                    break
+            else:
+                return T
+            if T < 0:
+                break
 
-        # Search the triangle(s) whose circumcircle contains p
-        bad_triangles = []
-        for T in self.triangles:
-            # Choose one method: inCircleRobust(T, p) or inCircleFast(T, p)
+        for T in np.flatnonzero(self.alive[:self.slotCount]):
             if self.inCircleFast(T, p):
-                bad_triangles.append(T)
+                return int(T)
+
+    def addPoint(self, p):
+        """Add a point to the current DT, and refine it using Bowyer-Watson.
+        """
+        self.addPoints([p])
+
+    def addPoints(self, points, order=None, rng=np.random):
+        """Add several points to the current DT.
+        order -- Optional insertion order: None keeps the given order,
+                 "hilbert" inserts along a Hilbert curve and "brio" uses
+                 biased randomized insertion rounds in Hilbert order.
+        rng   -- Random source of the "brio" rounds.
+        The vertex indices follow the given order of the points.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        first = self.coordCount
+        if first + len(points) > len(self.coords):
+            self.coords = grow(self.coords, first + len(points))
+        self.coords[first:first + len(points)] = points
+        self.coordCount += len(points)
+
+        if order is None:
+            insertion = range(len(points))
+        elif order == "hilbert":
+            insertion = hilbertOrder(points)
+        elif order == "brio":
+            insertion = brioOrder(points, rng)
+        else:
+            raise ValueError("Unknown insertion order: {0}".format(order))
+
+        for i in insertion:
+            self.insertVertex(first + int(i))
+
+    def insertVertex(self, idx):
+        """Insert the vertex idx of coords in the DT using Bowyer-Watson.
+        """
+        p = self.coords[idx]
+
+        # Search the triangle(s) whose circumcircle contains p: locate the
+        # triangle containing p and grow the cavity over the neighbours.
+        T = self.locate(p)
+        bad_triangles = {T}
+        stack = [T]
+        while stack:
+            for neigh in self.neighbours[stack.pop()].tolist():
+                # Choose one method: inCircleRobust(T, p) or inCircleFast(T, p)
+                if neigh >= 0 and neigh not in bad_triangles and self.inCircleFast(neigh, p):
+                    bad_triangles.add(neigh)
+                    stack.append(neigh)
 
         # Find the CCW boundary (star shape) of the bad triangles,
         # expressed as a list of edges (point pairs) and the opposite
         # triangle to each edge.
         boundary = []
-        # Choose a "random" triangle and edge
-        T = bad_triangles[0]
+        # Start at the triangle containing p and its first edge
         edge = 0
         # get the opposite triangle of this edge
         while True:
             # Check if edge of triangle T is on the boundary...
             # if opposite triangle of this edge is external to the list
-            tri_op = self.triangles[T][edge]
+            tri_op = int(self.neighbours[T, edge])
             if tri_op not in bad_triangles:
                 # Insert edge and external triangle into boundary list
-                boundary.append((T[(edge+1) % 3], T[(edge-1) % 3], tri_op))
+                tri = self.triangles[T]
+                boundary.append((int(tri[(edge+1) % 3]), int(tri[(edge-1) % 3]), tri_op))
 
                 # Move to next CCW edge in this triangle
                 edge = (edge + 1) % 3
@@ -129,91 +290,89 @@ class Delaunay2D:
                     break
             else:
                 # Move to next CCW edge in opposite triangle
-                edge = (self.triangles[tri_op].index(T) + 1) % 3
+                edge = (self.neighbours[tri_op].tolist().index(T) + 1) % 3
                 T = tri_op
 
         # Remove triangles too near of point p of our solution
-        for T in bad_triangles:
-            del self.triangles[T]
-            del self.circles[T]
+        bad_triangles = list(bad_triangles)
+        self.alive[bad_triangles] = False
+        self.freeSlots.extend(bad_triangles)
 
         # Retriangle the hole left by bad_triangles
-        new_triangles = []
-        for (e0, e1, tri_op) in boundary:
-            # Create a new triangle using point p and edge extremes
-            T = (idx, e0, e1)
-
-            # Store circumcenter and circumradius of the triangle
-            self.circles[T] = self.circumcenter(T)
-
-            # Set opposite triangle of the edge as neighbour of T
-            self.triangles[T] = [tri_op, None, None]
-
-            # Try to set T as neighbour of the opposite triangle
-            if tri_op:
-                # search the neighbour of tri_op that use edge (e1, e0)
-                for i, neigh in enumerate(self.triangles[tri_op]):
-                    if neigh:
-                        if e1 in neigh and e0 in neigh:
-                            # change link to use our new triangle
-                            self.triangles[tri_op][i] = T
-
-            # Add triangle to a temporal list
-            new_triangles.append(T)
-
-        # Link the new triangles each another
+        new_triangles = self.allocate(len(boundary))
+        e0, e1, tri_op = np.array(boundary, dtype=np.int32).T
         N = len(new_triangles)
-        for i, T in enumerate(new_triangles):
-            self.triangles[T][1] = new_triangles[(i+1) % N]   # next
-            self.triangles[T][2] = new_triangles[(i-1) % N]   # previous
+        slots = np.array(new_triangles, dtype=np.int32)
+
+        # Create new triangles using point p and edge extremes
+        self.triangles[slots] = np.column_stack((np.full(N, idx), e0, e1))
+
+        # Set opposite triangle of the edge as neighbour of each new triangle
+        # and link the new triangles each another (next, previous)
+        self.neighbours[slots] = np.column_stack((tri_op, np.roll(slots, -1), np.roll(slots, 1)))
+
+        # Set the new triangles as neighbour of the opposite triangles: the
+        # neighbour of tri_op across edge (e1, e0) is opposite to its third
+        # vertex
+        outer = tri_op >= 0
+        tris_op = self.triangles[tri_op[outer]]
+        third = (tris_op != e0[outer, None]) & (tris_op != e1[outer, None])
+        self.neighbours[tri_op[outer], np.argmax(third, axis=1)] = slots[outer]
+
+        # Store circumcenter and circumradius of the new triangles
+        self.storeCircles(slots)
+
+        self.last_triangle = new_triangles[0]
+
+    def liveTriangles(self):
+        """Slots of the current triangles.
+        """
+        return np.flatnonzero(self.alive[:self.slotCount])
+
+    def innerTriangles(self):
+        """Slots of the current triangles without a vertex in the extended BBox.
+        """
+        tris = self.triangles[:self.slotCount]
+        return np.flatnonzero(self.alive[:self.slotCount] & np.all(tris > 3, axis=1))
 
     def exportTriangles(self):
-        """Export the current list of Delaunay triangles
+        """Export the current Delaunay triangles as an (N, 3) array
         """
         # Filter out triangles with any vertex in the extended BBox
-        return [(a-4, b-4, c-4)
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
+        return self.triangles[self.innerTriangles()] - 4
 
     def exportCircles(self):
-        """Export the circumcircles as a list of (center, radius)
+        """Export the circumcircles as an (N, 2) array of centers and an (N,)
+        array of radius
         """
-        # Remember to compute circumcircles if not done before
-        # for t in self.triangles:
-        #     self.circles[t] = self.circumcenter(t)
-
         # Filter out triangles with any vertex in the extended BBox
         # Do sqrt of radius before of return
-        return [(self.circles[(a, b, c)][0], sqrt(self.circles[(a, b, c)][1]))
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
+        inner = self.innerTriangles()
+        return self.centers[inner], np.sqrt(self.radii[inner])
 
     def exportDT(self):
         """Export the current set of Delaunay coordinates and triangles.
         """
-        # Filter out coordinates in the extended BBox
-        coord = self.coords[4:]
+        # Filter out coordinates in the extended BBox, this is a view
+        coord = self.coords[4:self.coordCount]
 
         # Filter out triangles with any vertex in the extended BBox
-        tris = [(a-4, b-4, c-4)
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
-        return coord, tris
+        return coord, self.exportTriangles()
 
     def exportExtendedDT(self):
         """Export the Extended Delaunay Triangulation (with the frame vertex).
         """
-        return self.coords, list(self.triangles)
+        return self.coords[:self.coordCount], self.triangles[self.liveTriangles()]
 
     def exportVoronoiRegions(self):
         """Export coordinates and regions of Voronoi diagram as indexed data.
         """
-        # Remember to compute circumcircles if not done before
-        # for t in self.triangles:
-        #     self.circles[t] = self.circumcenter(t)
-        useVertex = {i: [] for i in range(len(self.coords))}
-        vor_coors = []
+        live = self.liveTriangles()
+        useVertex = {i: [] for i in range(self.coordCount)}
+        vor_coors = self.centers[live]
         index = {}
         # Build a list of coordinates and a index per triangle/region
-        for tidx, (a, b, c) in enumerate(self.triangles):
-            vor_coors.append(self.circles[(a, b, c)][0])
+        for tidx, (a, b, c) in enumerate(self.triangles[live].tolist()):
             # Insert triangle, rotating it so the key is the "last" vertex
             useVertex[a] += [(b, c, a)]
             useVertex[b] += [(c, a, b)]
@@ -227,7 +386,7 @@ class Delaunay2D:
         regions = {}
         # Sort each region in a coherent order, and substitude each triangle
         # by its index
-        for i in range(4, len(self.coords)):
+        for i in range(4, self.coordCount):
             v = useVertex[i][0][0]  # Get a vertex of a triangle
             r = []
             for _ in range(len(useVertex[i])):
@@ -1,28 +1,23 @@
 import math
-import pygame
+
+import numpy as np
 
 import landscape
 from delaunay2D import Delaunay2D
 
 
 class DelaunayLandscape(landscape.Landscape):
-    def __init__(self, landscape_size=400, area=(100, 100)):
-        super().__init__(landscape_size, area)
+    def __init__(self, landscape_size=400, area=(100, 100), **kwargs):
+        super().__init__(landscape_size, area, **kwargs)
 
     def generate_landscape(self):
-        delaunay = Delaunay2D(center=(self.area[0]/2, self.area[1]/2), radius=70)
-        for point in self.points:
-            delaunay.addPoint(point)
+        delaunay = Delaunay2D(center=(self.area[0]/2, self.area[1]/2), radius=0.7*max(self.area))
+        delaunay.addPoints(self.coordinates, order="brio", rng=self.rng)
         triangles = delaunay.exportTriangles()
 
-        for triangle in triangles:
-            edge1 = (triangle[0], triangle[1])
-            edge2 = (triangle[1], triangle[2])
-            edge3 = (triangle[0], triangle[2])
-            self.edges.add(edge1)
-            self.edges.add(edge2)
-            self.edges.add(edge3)
-
+        # every side of every triangle, shared sides are merged when the
+        # edges get their ids
+        self.edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [0, 2]]))
 
 if __name__ == "__main__":
     landscape = DelaunayLandscape()
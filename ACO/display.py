@@ -1,23 +1,56 @@
 import sys
+import numpy as np
 import pygame
 
 
 class Display(object):
-    def __init__(self, size=(900, 900)):
+    def __init__(self, size=(900, 900), scale=8, offset=50, cell_size=16, max_dirty_rects=500):
         pygame.init()
         self.size = size
+        self.scale = scale
+        self.offset = offset
         self.screen = pygame.display.set_mode(size)
         self.background = pygame.Surface(self.screen.get_size())
         self.background = self.background.convert()
         self.background.fill((127, 127, 127))
+
+        # the static graph drawn once by set_static_graph, frames then only
+        # redraw the edges that changed and the markers on top of it
+        self.static_layer = None
+        self.canvas = None
+        self.points = None
+        self.edges = None
+        self.edge_color = None
+        self.point_color = None
+        self.point_size = None
+        self.edge_colors = None
+        self.edge_widths = None
+        # dirty areas are tracked on a grid of cell_size pixel cells, with
+        # more than max_dirty_rects rectangles the whole screen is redrawn
+        self.cell_size = cell_size
+        self.max_dirty_rects = max_dirty_rects
+        self.marker_rects = []
+        self.dirty_rects = []
+
         self.clear()
         self.display()
 
     def __enter__(self):
-        self.clear()
+        if self.static_layer is None:
+            self.clear()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.display()
+        if self.static_layer is None:
+            self.display()
+        else:
+            pygame.display.update(self.dirty_rects)
+            self.dirty_rects = []
+
+    def quit_requested(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return True
+        return False
 
     def clear(self):
         self.screen.blit(self.background, (0, 0))
@@ -25,14 +58,116 @@ class Display(object):
     def display(self):
         pygame.display.flip()
 
+    def to_screen(self, points):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) * self.scale + self.offset
+
+    def set_static_graph(self, points, edges, edge_color=(255, 255, 255), point_color=(50, 50, 50), point_size=5):
+        # draw the background, every edge in edge_color with width 1 and the
+        # points on an off-screen surface and show it
+        self.points = self.to_screen(points)
+        self.edges = np.asarray(edges).reshape(-1, 2)
+        self.edge_color = np.array(edge_color)
+        self.point_color = point_color
+        self.point_size = point_size
+        self.edge_colors = np.tile(self.edge_color, (len(self.edges), 1))
+        self.edge_widths = np.ones(len(self.edges), dtype=np.int64)
+
+        self.static_layer = self.background.copy()
+        for point_a, point_b in self.points[self.edges].tolist():
+            pygame.draw.line(self.static_layer, edge_color, point_a, point_b, 1)
+        for point in self.points.tolist():
+            pygame.draw.circle(self.static_layer, point_color, point, point_size)
+
+        self.canvas = self.static_layer.copy()
+        self.screen.blit(self.static_layer, (0, 0))
+        self.marker_rects = []
+        self.dirty_rects = []
+        self.display()
+
+    def draw_edges(self, colors, widths):
+        # draw the edges of the static graph with the given colours and
+        # widths. Only the areas of edges that changed since the last frame
+        # and of the last frame's markers are restored from the static layer,
+        # the styled edges and points crossing them are drawn again. They are
+        # drawn whole on the canvas and only the restored areas are copied to
+        # the screen, clipping the drawing itself would move the pixels of
+        # lines and leave the rest of the screen painted over. Markers of the
+        # frame are drawn afterwards with draw_point.
+        colors = np.asarray(colors).reshape(-1, 3)
+        widths = np.asarray(widths)
+        changed = np.flatnonzero((colors != self.edge_colors).any(axis=1) | (widths != self.edge_widths))
+        if len(changed) + len(self.marker_rects) > self.max_dirty_rects:
+            rects = [self.screen.get_rect()]
+        else:
+            boxes = self.edge_boxes(changed, np.maximum(widths[changed], self.edge_widths[changed]))
+            rects = self.marker_rects + [pygame.Rect(box) for box in boxes.tolist()]
+        self.edge_colors[changed] = colors[changed]
+        self.edge_widths[changed] = widths[changed]
+        self.marker_rects = []
+        for rect in rects:
+            self.canvas.blit(self.static_layer, rect, rect)
+
+        covered = self.covered_cells(rects)
+        styled = np.flatnonzero((self.edge_colors != self.edge_color).any(axis=1) | (self.edge_widths != 1))
+        styled = styled[self.overlaps(covered, self.edge_boxes(styled, self.edge_widths[styled]))]
+        segments = self.points[self.edges[styled]].tolist()
+        for (point_a, point_b), color, width in zip(segments, self.edge_colors[styled].tolist(), self.edge_widths[styled].tolist()):
+            pygame.draw.line(self.canvas, color, point_a, point_b, width)
+
+        size = self.point_size
+        point_boxes = np.column_stack((np.floor(self.points) - size, np.full((len(self.points), 2), 2 * size + 1))).astype(np.int64)
+        for point in self.points[self.overlaps(covered, point_boxes)].tolist():
+            pygame.draw.circle(self.canvas, self.point_color, point, size)
+
+        for rect in rects:
+            self.screen.blit(self.canvas, rect, rect)
+        self.dirty_rects.extend(rects)
+
+    def edge_boxes(self, edges, widths):
+        # (x, y, width, height) screen boxes around the given edges drawn with
+        # the given line widths
+        ends = self.points[self.edges[edges]]
+        padding = (np.asarray(widths) // 2 + 2)[:, None]
+        corner = np.floor(ends.min(axis=1)) - padding
+        extent = np.ceil(ends.max(axis=1)) + padding + 1 - corner
+        return np.column_stack((corner, extent)).astype(np.int64).reshape(-1, 4)
+
+    def covered_cells(self, rects):
+        # summed area table of the grid cells touched by rects
+        cell_size = self.cell_size
+        covered = np.zeros((self.size[0] // cell_size + 1, self.size[1] // cell_size + 1), dtype=np.int64)
+        for rect in rects:
+            rect = rect.clip(self.screen.get_rect())
+            if rect.width and rect.height:
+                covered[rect.left // cell_size:(rect.right - 1) // cell_size + 1, rect.top // cell_size:(rect.bottom - 1) // cell_size + 1] = 1
+        table = np.zeros((covered.shape[0] + 1, covered.shape[1] + 1), dtype=np.int64)
+        table[1:, 1:] = covered.cumsum(axis=0).cumsum(axis=1)
+        return table
+
+    def overlaps(self, table, boxes):
+        # mask of the boxes touching a covered cell of the summed area table
+        columns, rows = table.shape[0] - 1, table.shape[1] - 1
+        left = np.clip(boxes[:, 0] // self.cell_size, 0, columns - 1)
+        top = np.clip(boxes[:, 1] // self.cell_size, 0, rows - 1)
+        right = np.clip((boxes[:, 0] + boxes[:, 2] - 1) // self.cell_size, 0, columns - 1) + 1
+        bottom = np.clip((boxes[:, 1] + boxes[:, 3] - 1) // self.cell_size, 0, rows - 1) + 1
+        return table[right, bottom] - table[left, bottom] - table[right, top] + table[left, top] > 0
+
     def draw_points(self, points, color=(0, 0, 0), point_size=5):
         for point in points:
             self.draw_point(point, color, point_size)
 
     def draw_point(self, point, point_color=(0, 0, 0), point_size=5):
-        pygame.draw.circle(self.screen, point_color, (point[0] * 8 + 50, point[1] * 8 + 50), point_size)
+        rect = pygame.draw.circle(self.screen, point_color, (point[0] * self.scale + self.offset, point[1] * self.scale + self.offset), point_size)
+        if self.static_layer is not None:
+            # restored from the static layer at the next frame
+            self.marker_rects.append(rect)
+            self.dirty_rects.append(rect)
 
     def draw_line(self, point_a, point_b, color=(0, 0, 255), line_width=1):
-        point_a = (point_a[0]*8 + 50, point_a[1]*8 + 50)
-        point_b = (point_b[0] * 8 + 50, point_b[1] * 8 + 50)
-        pygame.draw.line(self.screen, color, point_a, point_b, line_width)
\ No newline at end of file
+        point_a = (point_a[0] * self.scale + self.offset, point_a[1] * self.scale + self.offset)
+        point_b = (point_b[0] * self.scale + self.offset, point_b[1] * self.scale + self.offset)
+        rect = pygame.draw.line(self.screen, color, point_a, point_b, line_width)
+        if self.static_layer is not None:
+            self.marker_rects.append(rect)
+            self.dirty_rects.append(rect)
@@ -0,0 +1,104 @@
+import heapq
+
+import numpy as np
+
+
+class Graph(object):
+    # Frozen compressed sparse row graph of a landscape. Every undirected edge
+    # has an id, edge_list[id] holds its points with the smaller one first.
+    # The neighbours of point i are indices[indptr[i]:indptr[i + 1]], reached
+    # over the edges edges[indptr[i]:indptr[i + 1]], and reverse holds the
+    # entry of the same edge in the opposite direction. The arrays are read
+    # only once the graph is built.
+    __slots__ = ("point_count", "indptr", "indices", "edges", "reverse", "edge_list", "edge_lengths", "coordinates")
+
+    def __init__(self, point_count, edges, coordinates):
+        # edges is an (n, 2) array or a sequence of point pairs, both
+        # directions of an edge and repeated edges are merged
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        edge_list = np.unique(np.sort(edges, axis=1), axis=0)
+        edge_count = len(edge_list)
+        # entries count every edge twice, the largest one must fit the index type
+        index_type = np.int32 if 2 * edge_count < 2**31 else np.int64
+
+        sources = np.concatenate((edge_list[:, 0], edge_list[:, 1]))
+        targets = np.concatenate((edge_list[:, 1], edge_list[:, 0]))
+        order = np.argsort(sources, kind="stable")
+        edge_ids = np.arange(edge_count, dtype=index_type)
+
+        entries = np.empty(len(order), dtype=index_type)
+        entries[order] = np.arange(len(order), dtype=index_type)
+        reverse = np.empty(len(order), dtype=index_type)
+        reverse[entries] = np.roll(entries, edge_count)
+
+        indptr = np.zeros(point_count + 1, dtype=index_type)
+        np.cumsum(np.bincount(sources, minlength=point_count), out=indptr[1:])
+
+        coordinates = np.array(coordinates, dtype=np.float32).reshape(-1, 2)
+        difference = coordinates[edge_list[:, 0]] - coordinates[edge_list[:, 1]]
+
+        self.point_count = point_count
+        self.indptr = indptr
+        self.indices = targets[order].astype(np.int32)
+        self.edges = np.concatenate((edge_ids, edge_ids))[order]
+        self.reverse = reverse
+        self.edge_list = edge_list.astype(np.int32)
+        self.edge_lengths = np.hypot(difference[:, 0], difference[:, 1])
+        self.coordinates = coordinates
+
+        for name in self.__slots__[1:]:
+            getattr(self, name).flags.writeable = False
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # a graph from the arrays of another graph by slot name, for example
+        # memory mapped from a checkpoint, without rebuilding it
+        graph = cls.__new__(cls)
+        graph.point_count = len(arrays["indptr"]) - 1
+        for name in cls.__slots__[1:]:
+            setattr(graph, name, arrays[name])
+            getattr(graph, name).flags.writeable = False
+        return graph
+
+    @property
+    def edge_count(self):
+        return len(self.edge_list)
+
+    def candidate_lists(self, k):
+        # the csr entries of the k nearest neighbours of every point, nearest
+        # first: the candidates of point i are
+        # candidate_entries[candidate_indptr[i]:candidate_indptr[i + 1]] and
+        # candidate_positions holds the index of every entry in
+        # candidate_entries, -1 for entries that are not candidates
+        degrees = np.diff(self.indptr)
+        sources = np.repeat(np.arange(self.point_count), degrees)
+        order = np.lexsort((self.edge_lengths[self.edges], sources))
+        ranks = np.arange(len(order)) - self.indptr[sources[order]]
+        candidate_entries = order[ranks < k].astype(self.indptr.dtype)
+
+        candidate_indptr = np.zeros(self.point_count + 1, dtype=self.indptr.dtype)
+        np.cumsum(np.minimum(degrees, k), out=candidate_indptr[1:])
+        candidate_positions = np.full(len(self.indices), -1, dtype=self.indptr.dtype)
+        candidate_positions[candidate_entries] = np.arange(len(candidate_entries))
+        return candidate_indptr, candidate_entries, candidate_positions
+
+    def shortest_distances(self, source):
+        # Dijkstra over the edge lengths: the distance of every point from
+        # source, inf for points that cannot be reached
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        lengths = self.edge_lengths[self.edges].astype(np.float64).tolist()
+        distances = [float("inf")] * self.point_count
+        distances[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            distance, point = heapq.heappop(heap)
+            if distance > distances[point]:
+                continue
+            for entry in range(indptr[point], indptr[point + 1]):
+                neighbour = indices[entry]
+                neighbour_distance = distance + lengths[entry]
+                if neighbour_distance < distances[neighbour]:
+                    distances[neighbour] = neighbour_distance
+                    heapq.heappush(heap, (neighbour_distance, neighbour))
+        return np.array(distances)
@@ -1,30 +1,42 @@
 import math
 
+import numpy as np
+
 import landscape
+import spatial
 
 
 class GraphLandscape(landscape.Landscape):
-    def __init__(self, landscape_size=400, area=(100, 100)):
-        super().__init__(landscape_size, area)
+    def __init__(self, landscape_size=400, area=(100, 100), nearest_neighbours=None, cutoff_samples=200000, **kwargs):
+        # with nearest_neighbours every point connects to its k nearest
+        # points, otherwise to all points closer than the cutoff distance
+        self.nearest_neighbours = nearest_neighbours
+        self.cutoff_samples = cutoff_samples
+        super().__init__(landscape_size, area, **kwargs)
         self.network_points = []
-        self.generate_planar_network()
-
-    def generate_planar_network(self):
-        total_distances = []
-        for distances in self.matrix:
-            total_distances.extend(distances)
-        sorted_distances = sorted(total_distances)
-        cutoff_distance = sorted_distances[len(self.points) * int(len(self.points)**0.4)]
-
-        for x, point_a in enumerate(self.points):
-            for y, point_b in enumerate(self.points):
-                if x == y:
-                    continue
-                if self.matrix[x][y] < cutoff_distance:
-                    self.edges.append((x, y))
-                    self.display.draw_line(self.points[x], self.points[y])
+
+    def generate_landscape(self):
+        if self.nearest_neighbours:
+            self.edges = spatial.nearest_pairs(self.coordinates, self.nearest_neighbours)
+        else:
+            self.edges, _ = spatial.radius_pairs(self.coordinates, self.cutoff_distance())
+
+    def cutoff_distance(self):
+        # the distance below which len(points) * len(points)**0.4 of all
+        # len(points)**2 point pairs fall, exact when there is a distance
+        # matrix and estimated from random pairs otherwise
+        point_count = len(self.coordinates)
+        cutoff_index = point_count * int(point_count**0.4)
+        if self.distance_matrix is not None:
+            return np.partition(self.distance_matrix, cutoff_index, axis=None)[cutoff_index]
+
+        sample = self.point_distance(
+            self.rng.integers(0, point_count, size=self.cutoff_samples),
+            self.rng.integers(0, point_count, size=self.cutoff_samples)
+        )
+        return np.quantile(sample, cutoff_index / point_count**2)
+
 
 if __name__ == "__main__":
     landscape = GraphLandscape()
-
-    input()
\ No newline at end of file
+    landscape.simulate()
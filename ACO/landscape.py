@@ -1,35 +1,94 @@
-import random
+import queue
+import threading
 import time
 
-import pygame
+import numpy as np
 
-from display import Display
+import checkpoint
+import metrics
+import sampling
+from colony import AntColony, update_levels
+from graph import Graph
+from parallel import ColonyPool
 
-from colony import AntColony
+
+# largest landscape that gets a dense distance matrix in "auto" mode, 64MB
+DENSE_DISTANCE_LIMIT = 4096
 
 
 class Landscape(object):
-    def __init__(self, landscape_size=100, area=(100, 100), colony_count=4, food_count=10):
-        self.points = []
-        self.adjacency_list = {}
-        self.edges = set()
+    def __init__(self, landscape_size=100, area=(100, 100), colony_count=4, food_count=10, colony_options=None, processes=0, headless=False, distance_mode="auto", min_spacing=None, pheromone_tensor=False, seed=None, resume=None):
+        # seed is a numpy Generator or anything np.random.default_rng takes,
+        # the landscape draws from it and every colony gets a child stream.
+        # resume is a checkpoint directory written by save_checkpoint, the
+        # landscape continues from it instead of generating a new one.
+        self.rng = np.random.default_rng(seed)
+        # the edges made by generate_landscape, then the edge list of the graph
+        self.edges = None
+        self.graph = None
+        self.colony_options = colony_options or {}
         self.colonies = []
+        # with pheromone_tensor the landscape holds the pheromones of all
+        # colonies in one colonies x edges array, each colony works on its row
+        self.pheromones = None
+        self.new_pheromones = None
         self.foods = {}
+        # the food positions at the start of the current population
+        self.food_snapshot = None
         self.area = area
-
-        self.distance_matrix = []
+        self.iteration = 0
+        # shortest distances from every colony to every point, computed when
+        # first needed. Colonies never move, so respawned food only needs a
+        # lookup. converged_for counts the iterations all colonies have been
+        # near the optimum.
+        self.colony_distances = None
+        self.converged_for = 0
+        # the graph's candidate lists by k, built once for the colonies that
+        # walk on candidate lists
+        self.candidates = {}
+        self.last_report = None
+        # a metrics.Metrics while simulate is instrumented
+        self.metrics = None
+
+        # "dense" keeps a float32 matrix of all distances, "lazy" computes
+        # distances from the coordinates when needed, "auto" picks dense for
+        # small landscapes
+        self.distance_mode = distance_mode
+        self.distance_matrix = None
+        self.coordinates = None
         self.network_points = []
 
-        self.generate_points(landscape_size, area)
+        # with min_spacing the points are Poisson disk samples at least
+        # min_spacing apart instead of distinct integer points
+        self.min_spacing = min_spacing
+        if resume:
+            checkpoint.restore(self, resume)
+        else:
+            self.generate_points(landscape_size, area)
         self.calculate_distance_matrix()
 
-        self.display = Display()
-
-        self.generate_landscape()
-        self.create_adjacency_list()
-
-        self.generate_colonies(colony_count)
-        self.generate_food(food_count)
+        # a headless landscape never imports pygame and draws nothing
+        self.display = None
+        if not headless:
+            from display import Display
+            # the area is scaled to fill 800 of the 900 pixels of the window
+            self.display = Display(scale=800.0 / max(self.area))
+
+        if not resume:
+            self.generate_landscape()
+            self.create_graph()
+
+            self.generate_colonies(colony_count)
+            self.generate_food(food_count)
+            if pheromone_tensor:
+                self.create_pheromone_tensor()
+
+        # with processes the colonies walk in parallel worker processes,
+        # None uses one process per core. The colonies must use the batch
+        # engine.
+        self.colony_pool = None
+        if processes != 0:
+            self.colony_pool = ColonyPool(self, processes)
 
     def generate_landscape(self):
         raise NotImplementedError()
@@ -41,119 +100,330 @@ class Landscape(object):
             (0,0,255),
             (127,127,0)
         ]
+        # every colony gets its own child stream, of the landscape stream or
+        # of the seed in colony_options
+        colony_options = dict(self.colony_options)
+        seed = colony_options.pop("seed", None)
+        streams = self.rng if seed is None else np.random.default_rng(seed)
         while len(self.colonies) < colony_count:
-            colony_pos = random.randint(0, len(self.points))
+            colony_pos = int(self.rng.integers(0, len(self.coordinates)))
             if colony_pos not in self.foods:
-                self.colonies.append(AntColony(self, colony_pos, pheromone_color=pheromone_colors[len(self.colonies)]))
+                options = dict(colony_options, seed=streams.spawn(1)[0])
+                self.colonies.append(AntColony(self, colony_pos, pheromone_color=pheromone_colors[len(self.colonies)], **options))
+
+    def create_pheromone_tensor(self):
+        self.pheromones = np.array([colony.pheromones for colony in self.colonies]).reshape(len(self.colonies), self.graph.edge_count)
+        self.new_pheromones = np.zeros_like(self.pheromones)
+        self.attach_pheromone_rows()
+
+    def attach_pheromone_rows(self):
+        # point the pheromones of every colony at its row of the tensor
+        for colony, levels, deposits in zip(self.colonies, self.pheromones, self.new_pheromones):
+            colony.pheromones = levels
+            if not colony.lazy_decay:
+                colony.new_pheromones = deposits
+
+    def pheromone_levels(self):
+        # the current pheromone levels of all colonies, colonies x edges
+        if self.pheromones is not None and not any(colony.lazy_decay for colony in self.colonies):
+            return self.pheromones
+        return np.array([colony.pheromone_levels() for colony in self.colonies]).reshape(len(self.colonies), self.graph.edge_count)
 
     def generate_food(self, food_count):
         for i in range(food_count):
             self.foods[i] = 2000
 
-    def create_empty_matrix(self, size):
-        matrix = []
-        for x in range(size[0]):
-            row = []
-            for y in range(size[1]):
-                row.append(0)
-            matrix.append(row)
-        return matrix
-
     def generate_points(self, landscape_size, area):
-        while len(self.points) < landscape_size:
-            new_point = (random.randint(0, area[0]), random.randint(0, area[1]))
-            if new_point not in self.points:
-                self.points.append(new_point)
-
-    def calculate_distance_matrix(self):
-        self.distance_matrix = self.create_empty_matrix((len(self.points), len(self.points)))
-        for x, point_a in enumerate(self.points):
-            for y, point_b in enumerate(self.points):
-                self.distance_matrix[x][y] = self.distance(point_a, point_b)
-
-    def create_adjacency_list(self):
-        for edge in self.edges:
-            # TODO: setting again is not necessary
-            self.adjacency_list[edge[0]] = self.adjacency_list.get(edge[0], [])
-            self.adjacency_list[edge[0]].append(edge[1])
-
-            self.adjacency_list[edge[1]] = self.adjacency_list.get(edge[1], [])
-            self.adjacency_list[edge[1]].append(edge[0])
+        if self.min_spacing:
+            points = sampling.poisson_disk_points(landscape_size, area, self.min_spacing, rng=self.rng)
+        else:
+            points = sampling.unique_grid_points(landscape_size, area, rng=self.rng)
+        self.coordinates = np.array(points, dtype=np.float64).reshape(-1, 2)
+
+    def calculate_distance_matrix(self, block_size=1024):
+        point_count = len(self.coordinates)
+        if self.distance_mode == "auto":
+            self.distance_mode = "dense" if point_count <= DENSE_DISTANCE_LIMIT else "lazy"
+        if self.distance_mode == "lazy":
+            self.distance_matrix = None
+            return
+
+        # fill the matrix in blocks of rows to bound the temporary memory
+        self.distance_matrix = np.empty((point_count, point_count), dtype=np.float32)
+        for start in range(0, point_count, block_size):
+            block = self.coordinates[start:start + block_size]
+            self.distance_matrix[start:start + block_size] = np.hypot(
+                block[:, 0, None] - self.coordinates[None, :, 0],
+                block[:, 1, None] - self.coordinates[None, :, 1]
+            )
+
+    def point_distance(self, point_a, point_b):
+        # distance between points given by index, works on arrays of indices
+        if self.distance_matrix is not None:
+            return self.distance_matrix[point_a, point_b]
+        difference = self.coordinates[point_a] - self.coordinates[point_b]
+        return np.hypot(difference[..., 0], difference[..., 1])
+
+    def create_graph(self):
+        # the generated edges are a set of tuples or an (n, 2) array and may
+        # contain both directions of the same edge
+        edges = list(self.edges) if isinstance(self.edges, set) else self.edges
+        self.graph = Graph(len(self.coordinates), edges, self.coordinates)
+        self.edges = self.graph.edge_list
 
     def distance(self, point_a, point_b):
         return ((point_a[0] - point_b[0])**2 + (point_a[1] - point_b[1])**2)**0.5
 
-    def draw_points(self):
-        self.display.draw_points(self.points, color=(50,50,50))
+    def draw_static(self):
+        # the points and the edges without pheromones, cached by the display
+        self.display.set_static_graph(self.coordinates, self.graph.edge_list, edge_color=(255, 255, 255), point_color=(50, 50, 50))
 
     def draw_colonies(self):
         for colony in self.colonies:
-            self.display.draw_point(self.points[colony.position], point_color=colony.pheromone_color, point_size=10)
+            self.display.draw_point(self.coordinates[colony.position], point_color=colony.pheromone_color, point_size=10)
 
-    def draw_foods(self):
-        for idx in self.foods:
-            food_ratio = (self.foods[idx]/2000.0)
-            self.display.draw_point(self.points[idx], point_color=(0, 255*food_ratio, 0), point_size=5+round(3*food_ratio))
+    def draw_foods(self, foods=None):
+        foods = self.foods if foods is None else foods
+        for idx in foods:
+            food_ratio = (foods[idx]/2000.0)
+            self.display.draw_point(self.coordinates[idx], point_color=(0, 255*food_ratio, 0), point_size=5+round(3*food_ratio))
 
     def draw_pheromones(self):
         pass
 
-    def draw_lines(self):
-        for edge in self.edges:
-            total_pheromone_level = 0
-            partial_colors = [[], [], []]
-            for colony in self.colonies:
-                pheromone_level = colony.pheromone_matrix[edge]
-                total_pheromone_level += pheromone_level
-                for i in range(3):
-                    component = max(255 - (pheromone_level * (255 - colony.pheromone_color[i])), 0)
-                    partial_colors[i].append(component)
-
-            edge_color = (
-                min(partial_colors[0]), #/ (len(partial_colors[0])),
-                min(partial_colors[1]), #/ (len(partial_colors[1])),
-                min(partial_colors[2]) #/ (len(partial_colors[2]))
-            )
-
-            self.display.draw_line(
-                self.points[edge[0]],
-                self.points[edge[1]],
-                color=edge_color,
-                line_width=round(1+total_pheromone_level*6)
-            )
-
-    def draw(self):
+    def edge_styles(self, levels=None):
+        # colour and line width of every edge: every colony tints the edge
+        # towards its colour by its pheromone level and the darkest tint of
+        # every channel wins, the width grows with the total level
+        levels = self.pheromone_levels() if levels is None else levels
+        colors = np.array([colony.pheromone_color for colony in self.colonies], dtype=np.float64).reshape(-1, 3)
+        tints = np.maximum(255 - levels[:, :, None] * (255 - colors[:, None, :]), 0)
+        edge_colors = tints.min(axis=0, initial=255).astype(np.int64)
+        line_widths = np.round(1 + levels.sum(axis=0) * 6).astype(np.int64)
+        return edge_colors, line_widths
+
+    def draw_lines(self, levels=None):
+        edge_colors, line_widths = self.edge_styles(levels)
+        self.display.draw_edges(edge_colors, line_widths)
+
+    def draw(self, levels=None, foods=None):
+        # draws the current state, or a snapshot of the pheromone levels and
+        # foods taken by snapshot()
+        started = metrics.clock()
+        if self.display.static_layer is None:
+            self.draw_static()
         with self.display:
-            self.draw_lines()
-            self.draw_points()
+            self.draw_lines(levels)
 
             self.draw_colonies()
-            self.draw_foods()
+            self.draw_foods(foods)
             self.draw_pheromones()
+        if self.metrics:
+            metrics.count(self.metrics.phases, "draw", metrics.clock() - started)
+
+    def snapshot(self):
+        return np.array(self.pheromone_levels()), dict(self.foods)
+
+    def food_positions(self):
+        if self.food_snapshot is not None:
+            return self.food_snapshot
+        return np.array(list(self.foods), dtype=np.int64)
 
     def simulate_population(self):
-        for colony in self.colonies:
-            colony.optimize()
-        for colony in self.colonies:
-            colony.update_pheromones()
-
-    def simulate(self):
-        count = 0
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT: exit()
-            self.simulate_population()
-            self.draw()
+        # batch colonies all walk on the food as it was at the start of the
+        # population, in this process or in the worker pool alike
+        started = metrics.clock()
+        self.food_snapshot = np.array(list(self.foods), dtype=np.int64)
+        if self.colony_pool:
+            self.colony_pool.simulate_population()
+        else:
+            for colony in self.colonies:
+                colony.optimize()
+        self.food_snapshot = None
+        self.update_pheromones()
+        self.iteration += 1
+        if self.metrics:
+            metrics.count(self.metrics.phases, "simulate_population", metrics.clock() - started)
+
+    def update_pheromones(self):
+        # with the tensor and eager decay all colonies decay in one update
+        if self.pheromones is None or any(colony.lazy_decay for colony in self.colonies):
+            for colony in self.colonies:
+                colony.update_pheromones()
+            return
+        started = metrics.clock()
+        if self.metrics:
+            touched = np.count_nonzero(self.new_pheromones, axis=1)
+        decays = np.array([colony.pheromone_decay for colony in self.colonies])
+        bounds = [colony.strategy.bounds(colony) for colony in self.colonies]
+        if any(bounds):
+            # rows of unbounded colonies are clipped to bounds that never apply
+            bounds = np.array([colony_bounds or (0, np.inf) for colony_bounds in bounds]).T[:, :, None]
+        else:
+            bounds = None
+        update_levels(self.pheromones, self.new_pheromones, decays[:, None], bounds)
+        for colony_index, colony in enumerate(self.colonies):
+            colony.pheromone_floor = bounds[0, colony_index, 0] if bounds is not None else 0
+            colony.iteration += 1
+        if self.metrics:
+            metrics.count(self.metrics.phases, "update_pheromones", metrics.clock() - started)
+            for record, edges in zip(self.metrics.colonies, touched.tolist()):
+                metrics.count(record, "edges_touched", edges)
+
+    def optimal_distances(self):
+        # shortest distances from every colony to every point, colonies never
+        # move so they are computed once
+        if self.colony_distances is None:
+            self.colony_distances = np.array([self.graph.shortest_distances(colony.position) for colony in self.colonies]).reshape(len(self.colonies), self.graph.point_count)
+        return self.colony_distances
+
+    def path_ratios(self):
+        # the length of the dominant pheromone path of every colony over the
+        # length of the shortest path from the colony to any food, inf when
+        # the path does not lead to food
+        food_positions = list(self.foods)
+        ratios = []
+        for colony, distances in zip(self.colonies, self.optimal_distances()):
+            path, length = colony.dominant_path()
+            optimum = min(distances[food_positions].tolist(), default=float("inf"))
+            if path[-1] not in self.foods:
+                ratios.append(float("inf"))
+            elif optimum > 0:
+                ratios.append(length / optimum)
+            else:
+                ratios.append(1.0)
+        return ratios
+
+    def check_convergence(self, epsilon, patience):
+        # True once the dominant path of every colony has been within epsilon
+        # of the optimum for patience consecutive checks
+        ratios = self.path_ratios()
+        if self.metrics:
+            # inf is not valid json, colonies without a food path get None
+            for record, ratio in zip(self.metrics.colonies, ratios):
+                record["path_ratio"] = ratio if ratio != float("inf") else None
+        if all(ratio <= 1 + epsilon for ratio in ratios):
+            self.converged_for += 1
+        else:
+            self.converged_for = 0
+        return self.converged_for >= patience
+
+    def save_checkpoint(self, path):
+        checkpoint.save(self, path)
+
+    def close(self):
+        if self.colony_pool:
+            self.colony_pool.close()
+            self.colony_pool = None
+
+    def simulate(self, iterations=None, render_every=1, target_fps=None, report_interval=1.0, on_metrics=None, metrics_path=None, stop_epsilon=None, stop_patience=10):
+        # runs forever when iterations is None, draws every render_every
+        # iterations when there is a display. With target_fps the simulation
+        # runs freely in a thread and the display draws its latest state at
+        # most target_fps times a second. Progress is printed at most once
+        # every report_interval seconds. With on_metrics or metrics_path the
+        # timers and counters of every iteration are passed to on_metrics and
+        # written as JSON lines to metrics_path. With stop_epsilon the run
+        # ends once every colony's dominant path has stayed within
+        # stop_epsilon of the shortest path for stop_patience iterations.
+        # Returns True when the run converged.
+        if on_metrics or metrics_path:
+            self.start_metrics(on_metrics, metrics_path)
+        self.converged_for = 0
+        try:
+            if self.display and target_fps:
+                return self.simulate_threaded(iterations, target_fps, report_interval, stop_epsilon, stop_patience)
+            count = 0
+            while iterations is None or count < iterations:
+                if self.display and self.display.quit_requested():
+                    return False
+                self.simulate_population()
+                if self.display and render_every and count % render_every == 0:
+                    self.draw()
+                converged = stop_epsilon is not None and self.check_convergence(stop_epsilon, stop_patience)
+                self.end_iteration(count, report_interval)
+                if converged:
+                    return True
+                count += 1
+            return False
+        finally:
+            self.stop_metrics()
+
+    def start_metrics(self, callback=None, path=None):
+        self.metrics = metrics.Metrics(len(self.colonies), callback, path)
+        for colony, record in zip(self.colonies, self.metrics.colonies):
+            colony.metrics = record
+
+    def stop_metrics(self):
+        if self.metrics:
+            self.metrics.close()
+            self.metrics = None
+            for colony in self.colonies:
+                colony.metrics = None
+
+    def end_iteration(self, count, report_interval):
+        if self.metrics:
+            self.metrics.end_iteration()
+        self.report_progress(count, report_interval)
+
+    def simulate_threaded(self, iterations, target_fps, report_interval, stop_epsilon=None, stop_patience=10):
+        # pygame stays on this thread. When a frame is due a snapshot is
+        # requested, the simulation thread hands it over after its current
+        # iteration and the iterations in between are never drawn.
+        stop = threading.Event()
+        requested = threading.Event()
+        snapshots = queue.Queue(maxsize=1)
+        errors = []
+        converged = []
+
+        def run():
+            count = 0
+            try:
+                while not stop.is_set() and (iterations is None or count < iterations):
+                    self.simulate_population()
+                    if requested.is_set():
+                        requested.clear()
+                        snapshots.put(self.snapshot())
+                    if stop_epsilon is not None and self.check_convergence(stop_epsilon, stop_patience):
+                        converged.append(count)
+                        stop.set()
+                    self.end_iteration(count, report_interval)
+                    count += 1
+            except BaseException as error:
+                errors.append(error)
+
+        simulation = threading.Thread(target=run, daemon=True)
+        simulation.start()
+        frame_time = 1.0 / target_fps
+        requested.set()
+        while simulation.is_alive():
+            frame_start = time.time()
+            if self.display.quit_requested():
+                stop.set()
+                break
+            try:
+                levels, foods = snapshots.get(timeout=frame_time)
+            except queue.Empty:
+                continue
+            self.draw(levels, foods)
+            time.sleep(max(0.0, frame_start + frame_time - time.time()))
+            requested.set()
+
+        simulation.join()
+        if errors:
+            raise errors[0]
+        return bool(converged)
+
+    def report_progress(self, count, report_interval):
+        now = time.time()
+        if not report_interval or self.last_report is None or now - self.last_report >= report_interval:
             print("Iteration: {0}".format(count))
-            count += 1
+            self.last_report = now
 
-    def get_possible_paths(self, current_location):
-        try:
-            return self.adjacency_list[current_location]
-        except KeyError as e:
-            print(e)
-            print(self.adjacency_list)
-            raise
+    def candidate_lists(self, k):
+        if k not in self.candidates:
+            self.candidates[k] = self.graph.candidate_lists(k)
+        return self.candidates[k]
 
 if __name__ == "__main__":
     landscape = Landscape()
@@ -0,0 +1,48 @@
+import json
+import time
+
+
+clock = time.perf_counter
+
+
+def count(record, name, amount=1):
+    # add amount to a counter or timer of a metrics record
+    record[name] = record.get(name, 0) + amount
+
+
+class Metrics(object):
+    # Timers and counters of one landscape, collected per iteration. The
+    # landscape counts into phases and every colony into its own record of
+    # colonies, the records are plain dicts so counting costs a dict update.
+    # end_iteration hands the iteration to the callback and writes it as one
+    # JSON line to path.
+    def __init__(self, colony_count, callback=None, path=None):
+        self.callback = callback
+        self.file = open(path, "w") if path else None
+        self.iteration = 0
+        self.phases = {}
+        # the records are cleared, never replaced, so colonies can keep them
+        self.colonies = [{} for i in range(colony_count)]
+        self.iteration_start = clock()
+
+    def end_iteration(self):
+        now = clock()
+        record = {"iteration": self.iteration, "time": now - self.iteration_start}
+        record.update(self.phases)
+        record["colonies"] = [dict(colony) for colony in self.colonies]
+
+        if self.callback:
+            self.callback(record)
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+
+        self.phases.clear()
+        for colony in self.colonies:
+            colony.clear()
+        self.iteration += 1
+        self.iteration_start = clock()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
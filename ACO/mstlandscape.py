@@ -1,45 +1,45 @@
-import landscape
-
-
-class MSTLandscape(landscape.Landscape):
-    def __init__(self, landscape_size=400, area=(100,100)):
-        super().__init__(landscape_size, area)
-        self.network_points = []
-        self.generate_mst_network()
-
-    def generate_mst_network(self):
-        self.tree_points = [0]
-
-        while len(self.tree_points) < len(self.points):
-            (tree_point, closest_point) = self.find_closest_point_to_tree()
-            self.tree_points.append(closest_point)
-            self.edges.append((tree_point, closest_point))
-            self.display.draw_line(self.points[tree_point], self.points[closest_point])
-
-    def find_closest_point_to_tree(self):
-        min_distance = (self.area[0]**2 + self.area[1]**2)**0.5
-        min_tree_idx = -1
-        min_idx = -1
-        for point in self.tree_points:
-            (idx, distance) = self.find_closest_point_to_point(point)
-            if distance < min_distance and idx not in self.tree_points:
-                min_distance = distance
-                min_idx = idx
-                min_tree_idx = point
-        return (min_tree_idx, min_idx)
-
-    def find_closest_point_to_point(self, point):
-        min_distance = (self.area[0]**2 + self.area[1]**2)**0.5
-        min_idx = -1
-        for idx in range(len(self.points)):
-            if idx in self.tree_points:
-                continue
-            if self.matrix[point][idx] < min_distance:
-                min_idx = idx
-                min_distance = self.matrix[point][idx]
-        return (min_idx, min_distance)
+import numpy as np
+
+from delaunayLandscape import DelaunayLandscape
+
+
+class MSTLandscape(DelaunayLandscape):
+    def __init__(self, landscape_size=400, area=(100,100), **kwargs):
+        super().__init__(landscape_size, area, **kwargs)
+
+    def generate_landscape(self):
+        # the euclidean minimum spanning tree is part of the delaunay
+        # triangulation, so only the triangle sides are candidate edges
+        super().generate_landscape()
+        self.edges = self.minimum_spanning_tree(self.edges)
+
+    def minimum_spanning_tree(self, edges):
+        # Kruskal: add the edges from short to long when they join two
+        # different trees, the trees are kept in a union-find structure
+        edges = np.unique(np.sort(np.asarray(edges), axis=1), axis=0)
+        lengths = self.point_distance(edges[:, 0], edges[:, 1])
+        edges = edges[np.argsort(lengths, kind="stable")].tolist()
+
+        parents = list(range(len(self.coordinates)))
+
+        def find(point):
+            while parents[point] != point:
+                parents[point] = parents[parents[point]]  # path halving
+                point = parents[point]
+            return point
+
+        tree = []
+        for point_a, point_b in edges:
+            root_a = find(point_a)
+            root_b = find(point_b)
+            if root_a != root_b:
+                parents[root_a] = root_b
+                tree.append((point_a, point_b))
+                if len(tree) == len(self.coordinates) - 1:
+                    break
+        return np.array(tree, dtype=np.int64).reshape(-1, 2)
+
 
 if __name__ == "__main__":
     landscape = MSTLandscape()
-
-    input()
\ No newline at end of file
+    landscape.simulate()
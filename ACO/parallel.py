@@ -0,0 +1,203 @@
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+import walker
+from colony import decayed_levels
+
+
+# the arrays of Graph.candidate_lists, shared by k
+CANDIDATE_ARRAYS = ["candidate_indptr", "candidate_entries", "candidate_positions"]
+
+# shared arrays attached by a worker process, filled by attach_worker
+worker_arrays = {}
+worker_memory = []
+
+
+def share_array(array):
+    # copy array into a new shared memory block, returns the block and a view
+    # on it with the same contents
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+    shared[...] = array
+    return memory, shared
+
+
+def attach_worker(descriptions):
+    for key, (name, shape, dtype) in descriptions.items():
+        memory = shared_memory.SharedMemory(name=name)
+        worker_memory.append(memory)
+        worker_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def release(pool, memory):
+    # stops the workers and frees the shared memory of a pool, also when the
+    # landscape was never closed. The blocks are unlinked first, arrays of a
+    # landscape that is still alive may keep them mapped until they go.
+    pool.terminate()
+    for block in memory:
+        block.unlink()
+        try:
+            block.close()
+        except BufferError:
+            pass
+
+
+def walk_colony(task):
+    colony_index, position, colony_size, base_probability, max_steps, food_positions, seed, iteration, pheromone_decay, pheromone_floor, candidate_count = task
+    adjacency_edges = worker_arrays["edges"]
+    if "pheromones" in worker_arrays:
+        pheromones = worker_arrays["pheromones"][colony_index]
+    else:
+        pheromones = worker_arrays["pheromones_{0}".format(colony_index)]
+    stamps = worker_arrays.get("stamps_{0}".format(colony_index))
+    if stamps is not None:
+        # lazy colonies decay the levels of the segments the ants read only
+        def weights(entries):
+            edges = adjacency_edges[entries]
+            return base_probability + decayed_levels(pheromones[edges], stamps[edges], iteration, pheromone_decay, pheromone_floor)
+    else:
+        weights = base_probability + pheromones[adjacency_edges]
+
+    food_mask = np.zeros(len(worker_arrays["indptr"]) - 1, dtype=bool)
+    food_mask[food_positions] = True
+    candidates = None
+    if candidate_count:
+        candidates = [worker_arrays["{0}_{1}".format(name, candidate_count)] for name in CANDIDATE_ARRAYS]
+
+    walk = walker.walk_ants(
+        worker_arrays["indptr"],
+        worker_arrays["indices"],
+        worker_arrays["reverse"],
+        weights,
+        position,
+        food_mask,
+        colony_size,
+        max_steps,
+        np.random.default_rng(seed),
+        candidates
+    )
+    return walker.arrivals(adjacency_edges, worker_arrays["edge_lengths"], *walk)
+
+
+class ColonyPool(object):
+    # Runs the population walks of all colonies of a landscape in worker
+    # processes. The graph and the pheromones of every colony, or the
+    # pheromone tensor of the landscape, live in shared memory. The colonies
+    # keep working on views of the shared pheromones so the workers always see
+    # the current levels. Only batch colonies can walk in workers: serial
+    # colonies walk on the live food the colonies before them changed.
+    def __init__(self, landscape, processes=None):
+        serial = [colony.engine for colony in landscape.colonies if colony.engine != "batch"]
+        if serial:
+            raise ValueError("Colonies with engine {0!r} cannot walk in worker processes, use engine \"batch\"".format(serial[0]))
+        self.landscape = landscape
+        self.memory = []
+        descriptions = {}
+
+        graph = landscape.graph
+        arrays = {
+            "indptr": graph.indptr,
+            "indices": graph.indices,
+            "edges": graph.edges,
+            "reverse": graph.reverse,
+            "edge_lengths": graph.edge_lengths
+        }
+        for colony in landscape.colonies:
+            if colony.candidate_count:
+                candidates = landscape.candidate_lists(colony.candidate_count)
+                for name, array in zip(CANDIDATE_ARRAYS, candidates):
+                    arrays["{0}_{1}".format(name, colony.candidate_count)] = array
+        if landscape.pheromones is not None:
+            memory, landscape.pheromones = share_array(landscape.pheromones)
+            landscape.attach_pheromone_rows()
+            self.memory.append(memory)
+            descriptions["pheromones"] = (memory.name, landscape.pheromones.shape, landscape.pheromones.dtype)
+        for colony_index, colony in enumerate(landscape.colonies):
+            if landscape.pheromones is None:
+                memory, colony.pheromones = share_array(colony.pheromones)
+                self.memory.append(memory)
+                descriptions["pheromones_{0}".format(colony_index)] = (memory.name, colony.pheromones.shape, colony.pheromones.dtype)
+            if colony.lazy_decay:
+                memory, colony.pheromone_stamps = share_array(colony.pheromone_stamps)
+                self.memory.append(memory)
+                descriptions["stamps_{0}".format(colony_index)] = (memory.name, colony.pheromone_stamps.shape, colony.pheromone_stamps.dtype)
+
+        for key, array in arrays.items():
+            memory, shared = share_array(array)
+            self.memory.append(memory)
+            descriptions[key] = (memory.name, shared.shape, shared.dtype)
+
+        self.pool = multiprocessing.Pool(processes, initializer=attach_worker, initargs=(descriptions,))
+        # runs on close, when the pool is collected or at exit, whichever
+        # comes first
+        self.release = weakref.finalize(self, release, self.pool, self.memory)
+
+    def simulate_population(self):
+        # every colony walks on the food as it was at the start of the
+        # iteration, the arrivals are merged in colony order and then in ant
+        # order so food depletion and respawn do not depend on the scheduling
+        colonies = self.landscape.colonies
+        food_positions = self.landscape.food_positions()
+        tasks = [
+            (colony_index, colony.position, colony.colony_size, colony.base_probability, colony.max_steps, food_positions, colony.walk_seed(), colony.iteration, colony.pheromone_decay, colony.pheromone_floor, colony.candidate_count)
+            for colony_index, colony in enumerate(colonies)
+        ]
+
+        started = metrics.clock()
+        walks = self.pool.map(walk_colony, tasks)
+        if self.landscape.metrics:
+            metrics.count(self.landscape.metrics.phases, "pool_walk", metrics.clock() - started)
+
+        for colony, walk in zip(colonies, walks):
+            old_food_count = colony.food_count
+            colony.clear_pheromones()
+            colony.deliver(*walk)
+            colony.delta_food_count = old_food_count - colony.food_count
+            if colony.metrics is not None:
+                metrics.count(colony.metrics, "food", colony.food_count - old_food_count)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.landscape.pheromones is not None:
+            self.landscape.pheromones = self.landscape.pheromones.copy()
+            self.landscape.attach_pheromone_rows()
+        for colony in self.landscape.colonies:
+            if self.landscape.pheromones is None:
+                colony.pheromones = colony.pheromones.copy()
+            if colony.lazy_decay:
+                colony.pheromone_stamps = colony.pheromone_stamps.copy()
+        self.release()
+
+
+def reproducible(landscape_class, processes=2, iterations=20, seed=0, **options):
+    # runs a landscape of batch colonies with the same seed in this process
+    # and in processes workers, True if both give the same pheromones, foods
+    # and food counts bit for bit
+    colony_options = dict(options.pop("colony_options", {}), engine="batch")
+    results = []
+    for worker_count in (0, processes):
+        landscape = landscape_class(headless=True, processes=worker_count, seed=seed, colony_options=colony_options, **options)
+        for _ in range(iterations):
+            landscape.simulate_population()
+        levels, foods = landscape.snapshot()
+        results.append((levels, foods, [colony.food_count for colony in landscape.colonies]))
+        landscape.close()
+    (levels, foods, food_counts), (pool_levels, pool_foods, pool_food_counts) = results
+    return (
+        np.array_equal(levels, pool_levels)
+        and list(foods) == list(pool_foods)
+        and np.array_equal(list(foods.values()), list(pool_foods.values()))
+        and np.array_equal(food_counts, pool_food_counts)
+    )
+
+
+if __name__ == "__main__":
+    from delaunayLandscape import DelaunayLandscape
+
+    for options in ({}, {"pheromone_tensor": True}, {"colony_options": {"lazy_decay": True}}):
+        print(options, "reproducible" if reproducible(DelaunayLandscape, landscape_size=300, **options) else "DIFFERENT")
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def unique_grid_points(count, area, rng=None, batch_factor=1.2):
+    # count distinct integer points in [0, area[0]] x [0, area[1]], in the
+    # order they were drawn. Points are drawn in batches and duplicates are
+    # removed on their grid key. rng is a numpy Generator or a seed.
+    rng = np.random.default_rng(rng)
+    width, height = area[0] + 1, area[1] + 1
+    if count > width * height:
+        raise ValueError("Cannot place {0} distinct points on a {1}x{2} grid".format(count, width, height))
+
+    keys = np.zeros(0, dtype=np.int64)
+    while len(keys) < count:
+        missing = count - len(keys)
+        # expected number of draws to hit the missing free cells
+        draws = missing * batch_factor * width * height / (width * height - len(keys))
+        drawn = rng.integers(0, width * height, size=int(draws) + 16, dtype=np.int64)
+        keys = np.concatenate((keys, drawn))
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)][:count]
+
+    return np.column_stack((keys // height, keys % height))
+
+
+def poisson_disk_points(count, area, spacing, rng=None, batch_size=4096, max_failures=20):
+    # count points in [0, area[0]] x [0, area[1]] that are at least spacing
+    # apart. Candidates are thrown in batches, a grid with cells of
+    # spacing / sqrt(2) holds at most one point per cell so every candidate is
+    # checked against the points of the 5x5 cells around it.
+    rng = np.random.default_rng(rng)
+    cell_size = spacing / 2**0.5
+    columns = int(area[0] / cell_size) + 1
+    rows = int(area[1] / cell_size) + 1
+    grid = np.full((columns + 4, rows + 4), -1, dtype=np.int64)  # padded by 2 cells
+    batch_grid = np.full(grid.shape, -1, dtype=np.int64)
+    points = np.zeros((count, 2))
+    placed = 0
+    failures = 0
+    offsets = np.array([(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3)])
+
+    while placed < count:
+        candidates = rng.random((batch_size, 2)) * area
+        cells = (candidates / cell_size).astype(np.int64) + 2
+
+        # one candidate per cell, the first one drawn
+        _, first = np.unique(cells[:, 0] * (rows + 4) + cells[:, 1], return_index=True)
+        first = np.sort(first)
+        candidates, cells = candidates[first], cells[first]
+
+        # reject candidates too close to placed points
+        around = cells[:, None, :] + offsets[None, :, :]
+        neighbours = grid[around[..., 0], around[..., 1]]
+        near = np.linalg.norm(points[neighbours] - candidates[:, None, :], axis=2) < spacing
+        keep = ~np.any(near & (neighbours >= 0), axis=1)
+        candidates, cells, around = candidates[keep], cells[keep], around[keep]
+
+        # reject candidates too close to an earlier candidate of this batch
+        order = np.arange(len(candidates))
+        batch_grid[cells[:, 0], cells[:, 1]] = order
+        earlier = batch_grid[around[..., 0], around[..., 1]]
+        batch_grid[cells[:, 0], cells[:, 1]] = -1
+        near = np.linalg.norm(candidates[earlier] - candidates[:, None, :], axis=2) < spacing
+        keep = ~np.any(near & (earlier >= 0) & (earlier < order[:, None]), axis=1)
+        candidates, cells = candidates[keep][:count - placed], cells[keep][:count - placed]
+
+        if len(candidates) == 0:
+            failures += 1
+            if failures >= max_failures:
+                raise ValueError("Cannot place {0} points {1} apart in area {2}, placed {3}".format(count, spacing, area, placed))
+            continue
+        failures = 0
+
+        grid[cells[:, 0], cells[:, 1]] = np.arange(placed, placed + len(candidates))
+        points[placed:placed + len(candidates)] = candidates
+        placed += len(candidates)
+
+    return points
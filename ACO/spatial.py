@@ -0,0 +1,76 @@
+import numpy as np
+
+
+# half of the 3x3 block of grid cells around a cell, every pair of
+# neighbouring cells is visited once
+FORWARD_CELLS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def radius_pairs(coordinates, radius):
+    # all pairs (i, j) with i < j of points closer than radius, found with a
+    # grid of radius sized cells so only points in neighbouring cells are
+    # compared. Returns the pairs as an (n, 2) array and their distances.
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    point_count = len(coordinates)
+    if point_count < 2 or radius <= 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+
+    cells = np.floor((coordinates - coordinates.min(axis=0)) / radius).astype(np.int64)
+    # one empty cell of padding on each side, neighbour keys never wrap
+    width = cells[:, 1].max() + 3
+    keys = (cells[:, 0] + 1) * width + cells[:, 1] + 1
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    pairs = []
+    distances = []
+    for dx, dy in FORWARD_CELLS:
+        neighbour_keys = keys + dx * width + dy
+        start = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        counts = np.searchsorted(sorted_keys, neighbour_keys, side="right") - start
+
+        sources = np.repeat(np.arange(point_count), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        targets = order[np.repeat(start, counts) + offsets]
+
+        difference = coordinates[sources] - coordinates[targets]
+        distance = np.hypot(difference[:, 0], difference[:, 1])
+        keep = distance < radius
+        if (dx, dy) == (0, 0):
+            keep &= sources < targets
+
+        pair = np.column_stack((sources[keep], targets[keep]))
+        pairs.append(np.sort(pair, axis=1))
+        distances.append(distance[keep])
+
+    return np.concatenate(pairs), np.concatenate(distances)
+
+
+def nearest_pairs(coordinates, k):
+    # the pairs (i, j) where j is one of the k nearest points of i, the
+    # search radius doubles until every point has k candidates
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    point_count = len(coordinates)
+    k = min(k, point_count - 1)
+    if k <= 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    extent = np.ptp(coordinates, axis=0)
+    # radius of a disc holding 2k points on average
+    radius = max((2 * k * max(extent[0] * extent[1], 1.0) / (point_count * np.pi))**0.5, 1e-9)
+    while True:
+        pairs, distances = radius_pairs(coordinates, radius)
+        sources = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        if np.bincount(sources, minlength=point_count).min() >= k:
+            break
+        radius *= 2
+
+    targets = np.concatenate((pairs[:, 1], pairs[:, 0]))
+    distances = np.concatenate((distances, distances))
+
+    # rank the candidates of every point by distance, keep the first k
+    order = np.lexsort((distances, sources))
+    sources, targets = sources[order], targets[order]
+    first = np.searchsorted(sources, sources, side="left")
+    keep = np.arange(len(sources)) - first < k
+    return np.column_stack((sources[keep], targets[keep]))
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class AntSystem(object):
+    # The pheromone rule of a colony. deposit gets the paths of every ant of
+    # an iteration that reached food at once: the edges of all paths one after
+    # the other, the number of edges of every path and the path lengths, and
+    # deposits on the colony. bounds are the (lower, upper) levels the update
+    # clips to, None for unbounded trails.
+    # AntSystem is the original rule: every ant deposits pheromone_per_ant
+    # over its path length.
+    def __init__(self):
+        # the shortest path found so far, kept by every strategy
+        self.best_edges = None
+        self.best_length = float("inf")
+
+    def deposit(self, colony, edges, counts, lengths):
+        self.remember_best(edges, counts, lengths)
+        colony.deposit_pheromones(edges, np.repeat(colony.pheromone_per_ant / lengths, counts))
+
+    def bounds(self, colony):
+        return None
+
+    def remember_best(self, edges, counts, lengths):
+        if len(lengths) == 0:
+            return
+        best = int(np.argmin(lengths))
+        if lengths[best] < self.best_length:
+            self.best_edges = path_edges(edges, counts, best).copy()
+            self.best_length = float(lengths[best])
+
+
+class MaxMinAntSystem(AntSystem):
+    # Max-Min Ant System: only the best ant deposits, of the iteration or with
+    # best_so_far of the whole run, and trails are kept between
+    # upper = pheromone_per_ant / (decay * best length), the level the best
+    # path converges to, at most 1 like the other rules, and
+    # lower = min_ratio * upper.
+    def __init__(self, min_ratio=0.01, best_so_far=False):
+        AntSystem.__init__(self)
+        self.min_ratio = min_ratio
+        self.best_so_far = best_so_far
+
+    def deposit(self, colony, edges, counts, lengths):
+        self.remember_best(edges, counts, lengths)
+        if self.best_so_far:
+            if self.best_edges is not None:
+                colony.deposit_pheromones(self.best_edges, colony.pheromone_per_ant / self.best_length)
+        elif len(lengths):
+            best = int(np.argmin(lengths))
+            colony.deposit_pheromones(path_edges(edges, counts, best), colony.pheromone_per_ant / lengths[best])
+
+    def bounds(self, colony):
+        if self.best_edges is None:
+            return None
+        upper = min(1.0, colony.pheromone_per_ant / (colony.pheromone_decay * self.best_length))
+        return self.min_ratio * upper, upper
+
+
+class ElitistAntSystem(AntSystem):
+    # every ant deposits as in AntSystem and the best path so far gets
+    # elite_weight times the deposit of its ant on top
+    def __init__(self, elite_weight=5.0):
+        AntSystem.__init__(self)
+        self.elite_weight = elite_weight
+
+    def deposit(self, colony, edges, counts, lengths):
+        AntSystem.deposit(self, colony, edges, counts, lengths)
+        if self.best_edges is not None:
+            colony.deposit_pheromones(self.best_edges, self.elite_weight * colony.pheromone_per_ant / self.best_length)
+
+
+class RankBasedAntSystem(AntSystem):
+    # only the ranks - 1 shortest paths of the iteration deposit, the one of
+    # rank r weighted ranks - r, and the best path so far weighted ranks
+    def __init__(self, ranks=6):
+        AntSystem.__init__(self)
+        self.ranks = ranks
+
+    def deposit(self, colony, edges, counts, lengths):
+        self.remember_best(edges, counts, lengths)
+        if self.best_edges is None:
+            return
+        order = np.argsort(lengths, kind="stable")[:self.ranks - 1]
+        weights = np.zeros(len(lengths))
+        weights[order] = self.ranks - 1 - np.arange(len(order))
+        ranked = np.repeat(weights > 0, counts)
+        amounts = np.repeat(weights * colony.pheromone_per_ant / lengths, counts)
+        colony.deposit_pheromones(edges[ranked], amounts[ranked])
+        colony.deposit_pheromones(self.best_edges, self.ranks * colony.pheromone_per_ant / self.best_length)
+
+
+# the strategies by the names AntColony takes, new ones are added here
+STRATEGIES = {
+    "ant_system": AntSystem,
+    "max_min": MaxMinAntSystem,
+    "elitist": ElitistAntSystem,
+    "rank": RankBasedAntSystem
+}
+
+
+def create_strategy(name, options=None):
+    if name not in STRATEGIES:
+        raise ValueError("Unknown pheromone strategy: {0}".format(name))
+    return STRATEGIES[name](**(options or {}))
+
+
+def path_edges(edges, counts, path):
+    # the edges of one path of the concatenated paths
+    start = int(np.sum(counts[:path]))
+    return edges[start:start + int(counts[path])]
@@ -0,0 +1,111 @@
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import metrics
+from delaunayLandscape import DelaunayLandscape
+
+
+def convergence_iteration(food, window=10, tolerance=0.1):
+    # the first iteration from which the moving average of the food
+    # collected per iteration stays within tolerance of its final value, -1
+    # when no food was collected at the end
+    food = np.asarray(food, dtype=np.float64)
+    window = max(1, min(window, len(food)))
+    if len(food) == 0:
+        return -1
+    averages = np.convolve(food, np.ones(window) / window, mode="valid")
+    final = averages[-1]
+    if final <= 0:
+        return -1
+    outside = np.flatnonzero(np.abs(averages - final) > tolerance * final)
+    start = outside[-1] + 1 if len(outside) else 0
+    return int(start + window - 1)
+
+
+def run_configuration(task):
+    # one headless run of the sweep, the colonies run in this process. With
+    # epsilon the run stops once it converged to the shortest paths, the
+    # convergence iteration is -1 when it did not.
+    run, landscape_class, landscape_options, colony_options, seed, iterations, epsilon, patience = task
+    landscape = landscape_class(headless=True, processes=0, seed=seed, colony_options=colony_options, **landscape_options)
+    food = np.zeros(iterations, dtype=np.int64)
+    times = np.zeros(iterations)
+    convergence = -1
+    iterations_run = 0
+    for iteration in range(iterations):
+        iterations_run = iteration + 1
+        food_counts = sum(colony.food_count for colony in landscape.colonies)
+        started = metrics.clock()
+        landscape.simulate_population()
+        times[iteration] = metrics.clock() - started
+        food[iteration] = sum(colony.food_count for colony in landscape.colonies) - food_counts
+        if epsilon is not None and landscape.check_convergence(epsilon, patience):
+            convergence = iteration
+            break
+    landscape.close()
+    if epsilon is None:
+        convergence = convergence_iteration(food)
+    return run, food, times, convergence, iterations_run
+
+
+def sweep(grid, seeds, iterations=200, landscape_class=DelaunayLandscape, landscape_options=None, processes=None, path=None, epsilon=None, patience=10):
+    # Runs every combination of the AntColony arguments in grid, a dict of
+    # argument name to values, on a landscape for every seed, with a fixed
+    # budget of iterations, in a pool of processes (None uses every core).
+    # With epsilon a run ends early once every colony's dominant path stayed
+    # within epsilon of the shortest path for patience iterations.
+    # Returns the results as columns: run, seed, one column per argument,
+    # food and time per iteration (runs x iterations, zero after a run
+    # ended), the iterations run and the convergence iteration, and saves
+    # them to path as an .npz file.
+    landscape_options = landscape_options or {}
+    names = sorted(grid)
+    combinations = list(itertools.product(*[grid[name] for name in names]))
+    configurations = [(combination, seed) for combination in combinations for seed in seeds]
+    tasks = [
+        (run, landscape_class, landscape_options, dict(zip(names, combination)), seed, iterations, epsilon, patience)
+        for run, (combination, seed) in enumerate(configurations)
+    ]
+
+    food = np.zeros((len(tasks), iterations), dtype=np.int64)
+    times = np.zeros((len(tasks), iterations))
+    convergence = np.zeros(len(tasks), dtype=np.int64)
+    iterations_run = np.zeros(len(tasks), dtype=np.int64)
+    with multiprocessing.Pool(processes) as pool:
+        for run, run_food, run_times, run_convergence, run_iterations in pool.imap_unordered(run_configuration, tasks):
+            food[run] = run_food
+            times[run] = run_times
+            convergence[run] = run_convergence
+            iterations_run[run] = run_iterations
+
+    results = {
+        "run": np.arange(len(tasks)),
+        "seed": np.array([seed for combination, seed in configurations]),
+        "food": food,
+        "time": times,
+        "iterations": iterations_run,
+        "convergence": convergence
+    }
+    for column, name in enumerate(names):
+        results[name] = np.array([combination[column] for combination, seed in configurations])
+    if path:
+        np.savez(path, **results)
+    return results
+
+
+if __name__ == "__main__":
+    results = sweep(
+        {
+            "colony_size": [10, 30],
+            "base_probability": [0.01, 0.05],
+            "pheromone_per_ant": [0.1, 0.2],
+            "pheromone_decay": [0.005, 0.02]
+        },
+        seeds=range(4),
+        iterations=100,
+        landscape_options={"landscape_size": 400},
+        path="sweep.npz"
+    )
+    print("Runs: {0}, mean convergence iteration: {1}".format(len(results["run"]), results["convergence"].mean()))
@@ -0,0 +1,407 @@
+import bisect
+
+import numpy as np
+
+
+# multiplier of the fibonacci hash of the path index tables
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# the largest ants x points path index kept as a dense array, 16 MB
+DENSE_INDEX_LIMIT = 2**22
+# segments of at most SEARCH_WIDTH entries are searched by comparing the
+# draws with all their borders at once when SEARCH_ANTS or more ants draw,
+# a binary search over the whole table misses the cache on every level
+SEARCH_WIDTH = 16
+SEARCH_ANTS = 64
+# once no more than TAIL_ANTS ants walk, a step over arrays costs more than
+# walking them one after the other in python
+TAIL_ANTS = 16
+
+
+def find_slots(table_keys, keys, bits):
+    # the slots of an open addressing table of 2**bits slots, with linear
+    # probing, holding keys or the empty slot (key -1) where they would go
+    slots = ((keys.astype(np.uint64) * HASH_MULTIPLIER) >> np.uint64(64 - bits)).astype(np.int64)
+    stored = table_keys[slots]
+    collided = (stored != keys) & (stored != -1)
+    if not collided.any():
+        return slots
+    pending = np.flatnonzero(collided)
+    while len(pending):
+        slots[pending] = (slots[pending] + 1) & (len(table_keys) - 1)
+        stored = table_keys[slots[pending]]
+        pending = pending[(stored != keys[pending]) & (stored != -1)]
+    return slots
+
+
+def store(table_keys, table_values, keys, values, slots, bits):
+    # set the values of distinct keys, slots are their slots from find_slots.
+    # Keys that got the same empty slot are probed again, one of them got it.
+    while True:
+        table_keys[slots] = keys
+        table_values[slots] = values
+        lost = table_keys[slots] != keys
+        if not lost.any():
+            return
+        keys = keys[lost]
+        values = values[lost]
+        slots = find_slots(table_keys, keys, bits)
+
+
+def roulette(cumulative, weights, segment_start, segment_end, back, draws, width=None):
+    # one draw of every ant in its segment [segment_start, segment_end) of a
+    # table of weights, with cumulative[i] the total weight before entry i.
+    # The segment totals are differences of the borders. The entry back is
+    # left out, ants that leave nothing out point back at an entry of weight 0.
+    # With width, the largest segment size, cumulative holds width more
+    # borders of inf at the end for the search over the segment.
+    low = cumulative[segment_start]
+    back_weight = weights[back]
+    stop_at = low + draws * (cumulative[segment_end] - low - back_weight)
+    stop_at += back_weight * (stop_at >= cumulative[back])
+    if width is not None and width <= SEARCH_WIDTH and len(draws) >= SEARCH_ANTS:
+        borders = cumulative[np.arange(1, width)[:, None] + segment_start]
+        entries = segment_start + (borders <= stop_at).sum(axis=0)
+    else:
+        entries = cumulative.searchsorted(stop_at, side="right") - 1
+    np.minimum(entries, segment_end - 1, out=entries)
+    return entries
+
+
+def segment_roulette(weigh, table_entries, segment_start, segment_end, back, draws):
+    # the same roulette with the weights computed for the segments read
+    # only: the segments of the ants are laid out one after the other and
+    # weigh gives the weights of their csr entries, table_entries[i] for
+    # table index i or i itself when table_entries is None. The entry back
+    # gets no weight.
+    sizes = segment_end - segment_start
+    if len(sizes) == 0:
+        return segment_start
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    positions = np.arange(ends[-1]) + np.repeat(segment_start - starts, sizes)
+    segment_weights = weigh(positions if table_entries is None else table_entries[positions])
+    segment_weights[positions == np.repeat(back, sizes)] = 0
+    cumulative = np.concatenate(([0.0], np.cumsum(segment_weights)))
+    low = cumulative[starts]
+    stop_at = low + draws * (cumulative[ends] - low)
+    picks = np.searchsorted(cumulative, stop_at, side="right") - 1
+    np.minimum(picks, ends - 1, out=picks)
+    return positions[picks]
+
+
+def walk_ants(indptr, indices, reverse, weights, start, food_mask, ant_count, max_steps=200, rng=np.random, candidates=None):
+    # all ants walk from start together, one step at a time, until they reach
+    # food or take max_steps steps. weights holds the selection weight of every
+    # csr entry, or is a function giving the weights of an array of csr
+    # entries, then only the segments the ants are on are weighed. reverse
+    # holds the entry of the same edge in the other direction.
+    # With candidates, the candidate lists of Graph.candidate_lists, ants only
+    # pick among the candidates of their position and fall back to all
+    # neighbours when the way back is the only candidate.
+    # Ant i ends on the loop erased path paths[i, :sizes[i]] walked over the
+    # csr entries path_entries[i, :sizes[i] - 1] after steps[i] steps.
+    point_count = len(indptr) - 1
+    entry_count = len(indices)
+    segment_ends = indptr[1:]
+    # the entry an ant arriving over entry i must not take back: the reverse
+    # entry, or the extra entry entry_count of weight 0 where the way back is
+    # the only way out. The path entry entry_count stands for no entry.
+    degrees = np.diff(indptr)
+    back_entries = np.append(np.where(degrees[indices] > 1, reverse, entry_count), entry_count)
+    weigh = weights if callable(weights) else None
+    candidate_entries = None
+    if candidates is not None:
+        candidate_indptr, candidate_entries, candidate_positions = candidates
+        candidate_ends = candidate_indptr[1:]
+        # non candidates and the extra entry map to the extra candidate of
+        # weight 0
+        candidate_count = len(candidate_entries)
+        candidate_backs = np.append(np.where(candidate_positions >= 0, candidate_positions, candidate_count), candidate_count)
+    if weigh is None:
+        # cumulative[i] is the total weight of the csr entries before entry i,
+        # padded for the segment search
+        width = int(degrees.max())
+        cumulative = np.concatenate(([0.0], np.cumsum(weights), np.full(width, np.inf)))
+        weights = np.append(weights, 0.0)
+        if candidates is not None:
+            candidate_width = int(np.diff(candidate_indptr).max())
+            candidate_weights = np.append(weights[candidate_entries], 0.0)
+            candidate_cumulative = np.concatenate(([0.0], np.cumsum(candidate_weights[:-1]), np.full(candidate_width, np.inf)))
+
+    def choose(candidate, segment_start, segment_end, back, draws):
+        # the csr entries drawn in the csr segments, or with candidate in
+        # the candidate segments
+        table_entries = candidate_entries if candidate else None
+        if weigh is not None:
+            picks = segment_roulette(weigh, table_entries, segment_start, segment_end, back, draws)
+        elif candidate:
+            picks = roulette(candidate_cumulative, candidate_weights, segment_start, segment_end, back, draws, candidate_width)
+        else:
+            picks = roulette(cumulative, weights, segment_start, segment_end, back, draws, width)
+        return picks if table_entries is None else table_entries[picks]
+
+    if weigh is None:
+        candidate_tables = None
+        if candidates is not None:
+            candidate_tables = (candidate_indptr, candidate_entries, candidate_backs, candidate_cumulative, candidate_weights)
+        tail_ants = TAIL_ANTS
+    else:
+        # the weights of a function are summed per step over all ants, the
+        # tail would sum them per ant and round differently
+        tail_ants = 0
+
+    # the last column of path_entries stands for no entry, it is the entry
+    # before the start and ants that erase a loop write there
+    paths = np.zeros((ant_count, max_steps + 1), dtype=np.int32)
+    path_entries = np.zeros((ant_count, max_steps + 1), dtype=np.int64)
+    path_entries[:, max_steps] = entry_count
+    sizes = np.ones(ant_count, dtype=np.int64)
+    steps = np.zeros(ant_count, dtype=np.int64)
+    arrived = np.zeros(ant_count, dtype=bool)
+    paths[:, 0] = start
+
+    # (ant, position) -> index in the path of the ant. Entries are not
+    # cleared when a loop is erased, an entry is only valid if the path still
+    # holds the position at that index, and missing positions are looked up
+    # at index 0, where the start is. Small walks keep it as an ants x points
+    # array, others as a hash table keyed by ant * point_count + position
+    # with room for every step of every ant at half load.
+    if food_mask[start]:
+        arrived[:] = True
+        return paths, path_entries[:, :max_steps], sizes, arrived, steps
+    if indptr[start] == indptr[start + 1]:  # isolated point, no way to walk
+        return paths, path_entries[:, :max_steps], sizes, arrived, steps
+
+    dense_index = None
+    if ant_count * point_count <= DENSE_INDEX_LIMIT:
+        dense_index = np.zeros((ant_count, point_count), dtype=np.int32)
+    elif ant_count > tail_ants:
+        bits = int(2 * ant_count * min(max_steps + 1, point_count) - 1).bit_length()
+        table_keys = np.full(2**bits, -1, dtype=np.int64)
+        table_values = np.zeros(2**bits, dtype=np.int32)
+
+    # the walking ants with their position, path size and the entry they must
+    # not take back, kept in step so every step only reads the graph
+    walking = np.arange(ant_count)
+    current = np.full(ant_count, start, dtype=np.int64)
+    walking_sizes = np.ones(ant_count, dtype=np.int64)
+    back = np.full(ant_count, entry_count, dtype=np.int64)
+    step = 0
+    while step < max_steps and len(walking) > tail_ants:
+        step += 1
+        entry_start = indptr[current]
+        entry_end = segment_ends[current]
+
+        # roulette over the csr segment of every ant, without the entry back
+        # to the previous position unless it is the only way out
+        draws = rng.random(len(walking))
+        if candidates is None:
+            entries = choose(False, entry_start, entry_end, back, draws)
+        else:
+            candidate_start = candidate_indptr[current]
+            candidate_end = candidate_ends[current]
+            candidate_back = candidate_backs[back]
+            falling_back = candidate_end - candidate_start <= (candidate_back < candidate_count)
+            if not falling_back.any():
+                entries = choose(True, candidate_start, candidate_end, candidate_back, draws)
+            else:
+                picking = ~falling_back
+                entries = np.empty(len(walking), dtype=np.int64)
+                entries[picking] = choose(True, candidate_start[picking], candidate_end[picking], candidate_back[picking], draws[picking])
+                entries[falling_back] = choose(False, entry_start[falling_back], entry_end[falling_back], back[falling_back], draws[falling_back])
+        current = indices[entries]
+
+        if dense_index is not None:
+            loop_start = dense_index[walking, current]
+        else:
+            keys = walking * point_count + current
+            slots = find_slots(table_keys, keys, bits)
+            loop_start = np.where(table_keys[slots] == keys, table_values[slots], 0)
+        loops = (paths[walking, loop_start] == current) & (loop_start < walking_sizes)
+
+        # extend the paths, or erase the loops by cutting the path after the
+        # revisited position. Ants that erased a loop keep the entry that led
+        # to the position and write no entry to the last column.
+        index = np.where(loops, loop_start, walking_sizes)
+        paths[walking, index] = current
+        path_entries[walking, np.where(loops, max_steps, index - 1)] = np.where(loops, entry_count, entries)
+        if dense_index is not None:
+            dense_index[walking, current] = index
+        else:
+            store(table_keys, table_values, keys, index, slots, bits)
+        walking_sizes = index + 1
+        back = back_entries[path_entries[walking, index - 1]]
+
+        at_food = food_mask[current]
+        if at_food.any():
+            arriving = walking[at_food]
+            arrived[arriving] = True
+            sizes[arriving] = walking_sizes[at_food]
+            steps[arriving] = step
+            walking_on = ~at_food
+            walking = walking[walking_on]
+            current = current[walking_on]
+            walking_sizes = walking_sizes[walking_on]
+            back = back[walking_on]
+    if step < max_steps and len(walking):
+        finish_walks(
+            indptr, indices, back_entries, cumulative, weights, candidate_tables, food_mask, rng, step, max_steps,
+            walking, walking_sizes, paths, path_entries, sizes, steps, arrived
+        )
+    else:
+        sizes[walking] = walking_sizes
+        steps[walking] = max_steps
+
+    return paths, path_entries[:, :max_steps], sizes, arrived, steps
+
+
+def finish_walks(indptr, indices, back_entries, cumulative, weights, candidate_tables, food_mask, rng, step, max_steps, walking, walking_sizes, paths, path_entries, sizes, steps, arrived):
+    # walks the last ants of walk_ants from step on, one ant after the other
+    # on python lists. The ants draw the same numbers in the same order and
+    # the roulette does the same float operations, so the walks are the same
+    # as over arrays without the fixed cost of a step. The tables are the
+    # ones of walk_ants, candidate_tables (candidate_indptr,
+    # candidate_entries, candidate_backs, candidate_cumulative,
+    # candidate_weights) or None.
+    entry_count = len(indices)
+    if candidate_tables is not None:
+        candidate_indptr, candidate_entries, candidate_backs, candidate_cumulative, candidate_weights = candidate_tables
+        candidate_count = len(candidate_entries)
+
+    # The roulette of a point: its first and end table index, the offset of
+    # the lists, the borders and weights of the table entries, their csr
+    # entries, the points they lead to, the entries not to take back from
+    # there and whether the points hold food. Small tables are read into
+    # lists at once, shared by all points, large ones a point at a time on
+    # the first visit. A point segment costs about as much as reading a
+    # hundred entries.
+    whole_tables = entry_count <= 16 * len(walking) * (max_steps - step)
+    segments = {}
+    candidate_segments = {}
+    if whole_tables:
+        indptr_list = indptr.tolist()
+        tables = (
+            0, cumulative[:entry_count + 1].tolist(), weights.tolist(), range(entry_count),
+            indices.tolist(), back_entries.tolist(), food_mask[indices].tolist()
+        )
+        if candidate_tables is not None:
+            candidate_indptr_list = candidate_indptr.tolist()
+            candidate_positions = indices[candidate_entries]
+            candidate_lists = (
+                0, candidate_cumulative[:candidate_count + 1].tolist(), candidate_weights.tolist(), candidate_entries.tolist(),
+                candidate_positions.tolist(), back_entries[candidate_entries].tolist(), food_mask[candidate_positions].tolist()
+            )
+
+    def segment(position):
+        if whole_tables:
+            segments[position] = (indptr_list[position], indptr_list[position + 1]) + tables
+            return segments[position]
+        low = int(indptr[position])
+        high = int(indptr[position + 1])
+        positions = indices[low:high]
+        segments[position] = (
+            low, high, low, cumulative[low:high + 1].tolist(), weights[low:high].tolist(), range(low, high),
+            positions.tolist(), back_entries[low:high].tolist(), food_mask[positions].tolist()
+        )
+        return segments[position]
+
+    def candidate_segment(position):
+        if whole_tables:
+            candidate_segments[position] = (candidate_indptr_list[position], candidate_indptr_list[position + 1]) + candidate_lists
+            return candidate_segments[position]
+        low = int(candidate_indptr[position])
+        high = int(candidate_indptr[position + 1])
+        entries = candidate_entries[low:high]
+        positions = indices[entries]
+        candidate_segments[position] = (
+            low, high, low, candidate_cumulative[low:high + 1].tolist(), candidate_weights[low:high].tolist(), entries.tolist(),
+            positions.tolist(), back_entries[entries].tolist(), food_mask[positions].tolist()
+        )
+        return candidate_segments[position]
+
+    # every ant as its path, the csr entries of the path, the entry not to
+    # take back at every point of the path and the index of the points on the
+    # path, which keeps erased points
+    ants = []
+    for ant, size in zip(walking.tolist(), walking_sizes.tolist()):
+        path = paths[ant, :size].tolist()
+        ant_entries = path_entries[ant, :size - 1].tolist()
+        backs = [entry_count] + back_entries[ant_entries].tolist()
+        ants.append((ant, path, ant_entries, backs, dict((position, index) for index, position in enumerate(path))))
+
+    while ants and step < max_steps:
+        step += 1
+        walking_on = []
+        for walk, draw in zip(ants, rng.random(len(ants)).tolist()):
+            ant, path, ant_entries, backs, index_of = walk
+            position = path[-1]
+            back = backs[-1]
+            chosen = None
+            if candidate_tables is not None:
+                # the candidates, unless the way back is the only one
+                chosen = candidate_segments.get(position) or candidate_segment(position)
+                candidate_back = int(candidate_backs[back])
+                if chosen[1] - chosen[0] > (candidate_back < candidate_count):
+                    back = candidate_back
+                else:
+                    chosen = None
+            if chosen is None:
+                chosen = segments.get(position) or segment(position)
+            low, high, offset, borders, segment_weights, entries, positions, next_backs, foods = chosen
+
+            # the roulette of walk_ants over the list indices first to last
+            first = low - offset
+            last = high - offset
+            back -= offset
+            back_weight = segment_weights[back] if first <= back < last else 0.0
+            stop_at = borders[first] + draw * (borders[last] - borders[first] - back_weight)
+            if back_weight:
+                stop_at += back_weight * (stop_at >= borders[back])
+            pick = min(bisect.bisect_right(borders, stop_at, first, last + 1) - 1, last - 1)
+            position = positions[pick]
+
+            index = index_of.get(position)
+            if index is not None and index < len(path) and path[index] == position:
+                # erase the loop
+                del path[index + 1:]
+                del ant_entries[index:]
+                del backs[index + 1:]
+            else:
+                index_of[position] = len(path)
+                path.append(position)
+                ant_entries.append(entries[pick])
+                backs.append(next_backs[pick])
+
+            if foods[pick]:
+                arrived[ant] = True
+                steps[ant] = step
+                finish_walk(ant, path, ant_entries, paths, path_entries, sizes)
+            else:
+                walking_on.append(walk)
+        ants = walking_on
+
+    for ant, path, ant_entries, backs, index_of in ants:
+        steps[ant] = max_steps
+        finish_walk(ant, path, ant_entries, paths, path_entries, sizes)
+
+
+def finish_walk(ant, path, ant_entries, paths, path_entries, sizes):
+    size = len(path)
+    paths[ant, :size] = path
+    path_entries[ant, :size - 1] = ant_entries
+    sizes[ant] = size
+
+
+def arrivals(adjacency_edges, edge_lengths, paths, path_entries, sizes, arrived, steps):
+    # compact the walk to the ants that reached food, in ant order: the food
+    # they reached, the length of their path, the number of edges on their
+    # path and the edge ids, followed by the steps taken by all ants and the
+    # number of ants that did not reach food
+    ants = np.flatnonzero(arrived)
+    food_positions = paths[ants, sizes[ants] - 1]
+    edge_counts = sizes[ants] - 1
+    width = edge_counts.max() if len(ants) else 0
+    path_edges = adjacency_edges[path_entries[ants, :width]]
+    on_path = np.arange(width) < edge_counts[:, None]
+    path_lengths = np.where(on_path, edge_lengths[path_edges], 0).sum(axis=1, dtype=np.float64)
+    return food_positions, path_lengths, edge_counts, path_edges, int(steps.sum()), len(arrived) - len(ants)